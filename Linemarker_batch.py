@@ -0,0 +1,67 @@
+#!python
+#########################################
+#Apply frequency windows to many spectra without the GUI.
+#e.g.
+#   $ python Linemarker_batch.py spw*.tsv --winfile common_winstr.txt --fitorder 1
+#   $ python Linemarker_batch.py data/ --winsuffix _strict_winstr.txt --outsuffix _strict_winstr.txt
+#   $ python Linemarker_batch.py data/ --auto sigmaclip --case loose --outsuffix _loose_winstr.txt
+#########################################
+
+import os
+import sys
+import argparse
+
+import Linemarker_core as core
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Apply frequency windows to many spectra, and write the windows files and pdf snapshots.')
+    parser.add_argument('spectra',nargs='+',help='spectrum files, or directories of spectrum files')
+    wingroup = parser.add_mutually_exclusive_group(required=True)
+    wingroup.add_argument('-w','--winfile',help='one windows file applied to all the spectra')
+    wingroup.add_argument('-s','--winstr',help='one windows string applied to all the spectra, e.g. 216988.6683~216995.9926;217078.5120~217079.9769')
+    wingroup.add_argument('--winsuffix',help='read the windows of path/specfile.tsv from path/specfile+WINSUFFIX')
+    wingroup.add_argument('--auto',choices=['sigmaclip','runmed'],help='select the line-free windows automatically with this method')
+    parser.add_argument('--case',choices=['strict','loose'],default='strict',help='the case of the automatic selection (default: %(default)s)')
+    parser.add_argument('-o','--outsuffix',default=core.winstr_appendstr,help='suffix of the output windows files (default: %(default)s)')
+    parser.add_argument('--outdir',default=None,help='directory of the outputs (default: the directory of each spectrum)')
+    parser.add_argument('-f','--fitorder',type=int,default=-1,help='order of the baseline drawn in the pdf, negative for no baseline, also used by --auto sigmaclip (at least 1) (default: %(default)s)')
+    parser.add_argument('--nopdf',action='store_true',help='do not write the pdf snapshots')
+    parser.add_argument('-p','--precision',type=int,default=core.winstr_precision,help='decimals of the frequencies (MHz) written, negative for the full precision (default: %(default)s)')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    specfiles = core.find_spectra(args.spectra)
+    winstr = None
+    if args.winfile is not None:
+        winstr = core.read_winstr(args.winfile)
+    elif args.winstr is not None:
+        winstr = args.winstr
+    if args.outdir is not None:
+        os.makedirs(args.outdir,exist_ok=True)
+
+    fig = None if args.nopdf else core.new_figure()
+    nfailed = 0
+    for specfile in specfiles:
+        path_prefix = os.path.splitext(specfile)[0]
+        outdir = os.path.dirname(specfile) if args.outdir is None else args.outdir
+        outfile = os.path.join(outdir,os.path.basename(path_prefix)+args.outsuffix)
+        try:
+            if args.winsuffix is not None:
+                _winstr = core.read_winstr(path_prefix+args.winsuffix)
+            else:
+                _winstr = winstr
+            core.process_spectrum(specfile,_winstr,outfile=outfile,fitorder=args.fitorder,
+                                  savepdf=not args.nopdf,fig=fig,auto=args.auto,case=args.case,
+                                  precision=args.precision)
+        except Exception as e:
+            nfailed += 1
+            print('failed to process %s: %s' %(specfile,e))
+    print('%i of %i spectra processed' %(len(specfiles)-nfailed,len(specfiles)))
+    return 1 if nfailed>0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
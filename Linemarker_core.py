@@ -0,0 +1,1461 @@
+#########################################
+#GUI-free core of the linemarker.
+#Everything here works on plain numpy arrays, so that it can be used by
+#the Tk application (Linemarker_tk_v1.py) as well as by the batch entry
+#point (Linemarker_batch.py) without a display.
+#########################################
+
+import os
+import glob
+import tempfile
+import warnings
+import numpy as np
+
+winstr_appendstr = '_winstr.txt'
+#the outputs of Linemarker_export.py, outprefix+contsub_appendstr+ext and outprefix+winstats_appendstr
+contsub_appendstr = '_contsub'
+winstats_appendstr = '_winstats.tsv'
+winstr_precision = 4  # decimals of the frequencies (MHz) written in the windows strings, negative for the full precision
+
+
+cache_ext = '.npy'
+
+
+def _parse_block(block,ncol):
+    """
+    Parse a block of whole lines of numbers separated by white spaces into an array of shape (nrow,ncol).
+    numpy parses the whole block in one pass, and falls back to np.loadtxt for blocks with comments, blank lines
+    or lines of another number of columns, which are then rejected.
+    """
+    with warnings.catch_warnings():
+        #a DeprecationWarning is raised if the text can not be read to its end
+        warnings.simplefilter('error',DeprecationWarning)
+        try:
+            data = np.fromstring(block,dtype='float64',sep=' ')
+        except (ValueError,DeprecationWarning):
+            data = None
+    #the numbers are not checked line by line, only their count against the lines
+    nline = block.count(b'\n')+(len(block)>0 and not block.endswith(b'\n'))
+    if (data is None) or (len(data) != nline*ncol):
+        import io
+        data = np.loadtxt(io.BytesIO(block),dtype='float64',comments='#',ndmin=2)
+        if data.size > 0 and data.shape[1] != ncol:
+            raise ValueError('lines of %i columns where %i columns are expected' %(data.shape[1],ncol))
+    return data.reshape(-1,ncol)
+
+
+def read_text(filename,delimiter=None,progress=None,chunksize=2**22):
+    """
+    Read a spectrum from a text file of columns of numbers, separated by white spaces (e.g., tsv) or by delimiter (e.g., ',').
+    Return (x,y,header), with x and y the first two columns, and header the text of the lines skipped before the numbers,
+    i.e. the lines starting with '#' and one line of column names.
+    The file is read and parsed in blocks of about chunksize bytes, and only the first two columns are kept,
+    so the memory needed is about that of x and y, whatever the size of the file.
+    progress, if given, is called with the fraction done after each block, and may raise to abort the reading
+    (see util/loader.py).
+    A ValueError is raised if the file can not be parsed.
+    """
+    size = max(os.path.getsize(filename),1)
+    xs,ys = [],[]
+    header = []
+    names = False
+    ncol = None
+    rest = b''
+    nread = 0
+    with open(filename,'rb') as f:
+        while True:
+            block = f.read(chunksize)
+            nread += len(block)
+            if block:
+                #the blocks end at a line end, so that each one holds whole lines
+                block = rest+block
+                end = block.rfind(b'\n')+1
+                block,rest = block[:end],block[end:]
+            else:
+                block,rest = rest,b''
+                if not block:
+                    break
+            while (ncol is None) and block:
+                end = block.find(b'\n')+1 or len(block)
+                line = block[:end].strip()
+                fields = line.split() if delimiter is None else line.replace(delimiter.encode(),b' ').split()
+                if line.startswith(b'#') or (not fields):
+                    header.append(line.decode(errors='replace'))
+                    block = block[end:]
+                    continue
+                try:
+                    [float(v) for v in fields]
+                    ncol = len(fields)
+                except ValueError:
+                    if names:
+                        raise ValueError('can not parse the line "%s" of %s' %(line.decode(errors='replace'),filename))
+                    #column names, e.g., "freq,flux"
+                    names = True
+                    header.append(line.decode(errors='replace'))
+                    block = block[end:]
+            if ncol is None:
+                continue
+            if delimiter is not None:
+                block = block.replace(delimiter.encode(),b' ')
+            if ncol < 2:
+                raise ValueError('%s has less than two columns' %filename)
+            data = _parse_block(block,ncol)
+            xs.append(data[:,0].copy())
+            ys.append(data[:,1].copy())
+            if progress is not None:
+                progress(min(nread/size,1.))
+    if len(xs) == 0:
+        raise ValueError('no data found in %s' %filename)
+    return np.concatenate(xs), np.concatenate(ys), '\n'.join(header)
+
+
+def read_tsv(filename,progress=None,chunksize=2**22):
+    """
+    Read the tsv file exported by the CASA viewer, i.e. lines of '#' headers followed by two columns of numbers.
+    """
+    x,y,header = read_text(filename,progress=progress,chunksize=chunksize)
+    return x,y
+
+
+def read_csv(filename,progress=None,chunksize=2**22):
+    return read_text(filename,delimiter=',',progress=progress,chunksize=chunksize)
+
+
+def text_unit_factor(header,default=1E3):
+    """
+    The factor converting the x of a text file into MHz, from the first frequency unit found in its header,
+    e.g. "# xLabel: [LSRK] Frequency (GHz)" or "freq_MHz,flux". The default is for GHz, as exported by the CASA viewer.
+    """
+    import re
+    factors = {'ghz':1E3,'mhz':1.,'khz':1E-3,'hz':1E-6}
+    match = re.search(r'(?<![a-z])(ghz|mhz|khz|hz)(?![a-z])',header.lower())
+    return default if match is None else factors[match.group(1)]
+
+
+def spectral_axis_mhz(wcs,nchan):
+    """
+    The frequencies (MHz) of the nchan channels along the spectral axis of wcs.
+    Velocity and wavelength axes are converted to frequency by WCSLIB, which needs the rest frequency for velocities.
+    """
+    spec = wcs.spectral
+    if not spec.wcs.ctype[0].startswith('FREQ'):
+        spec = spec.deepcopy()
+        try:
+            spec.wcs.sptr('FREQ-???')
+        except Exception as e:
+            raise ValueError('can not convert the spectral axis %s to frequency: %s' %(spec.wcs.ctype[0],e))
+    x = spec.pixel_to_world_values(np.arange(nchan))
+    return np.asarray(x,dtype='float64')*1E-6  # Hz to MHz
+
+
+def read_fits_spectrum(filename,progress=None):
+    """
+    Read a 1D spectrum from a FITS image, i.e. an image with a single non-degenerate axis, which is spectral.
+    The frequencies are computed from the WCS of the header, or else read from an image extension FREQ
+    (in the unit of its BUNIT, MHz by default), as written by Linemarker_export.py for uneven channels.
+    The data are memory-mapped, and converted into native float64 in blocks.
+    """
+    import astropy.io.fits as fits
+    from astropy.wcs import WCS
+    with fits.open(filename,memmap=True) as hdul:
+        for hdu in hdul:
+            if (hdu.is_image) and (hdu.data is not None):
+                break
+        else:
+            raise ValueError('no image found in %s' %filename)
+        wcs = WCS(hdu.header)
+        freq = hdul['FREQ'] if ('FREQ' in hdul) and (hdul['FREQ'] is not hdu) else None
+        if (not wcs.has_spectral) and (freq is None):
+            raise ValueError('no spectral axis found in %s' %filename)
+        data = hdu.data
+        if sum(n!=1 for n in data.shape) > 1:
+            raise ValueError('%s is not a 1D spectrum (shape %s), see Linemarker_cube.py for cubes' %(filename,data.shape))
+        nchan = data.size if freq is not None else data.shape[data.ndim-1-wcs.wcs.spec]
+        data = data.reshape(nchan)
+        y = np.empty(nchan,dtype='float64')
+        step = 2**22
+        for i0 in range(0,nchan,step):
+            y[i0:i0+step] = data[i0:i0+step]
+            if progress is not None:
+                progress(min((i0+step)/nchan,1.))
+        if freq is None:
+            x = spectral_axis_mhz(wcs,nchan)
+        else:
+            if freq.data.size != nchan:
+                raise ValueError('the FREQ extension of %s has %i channels, the spectrum %i' %(filename,freq.data.size,nchan))
+            x = np.asarray(freq.data,dtype='float64').reshape(nchan)*text_unit_factor(freq.header.get('BUNIT',''),default=1.)
+    return x,y
+
+
+spectrum_exts = ('.tsv','.csv','.txt','.dat','.fits','.fit')
+
+
+def finite_channels(x,y):
+    """
+    Drop the blanked (NaN) channels, e.g. at the edges of a band, which the fits and the plots can not handle.
+    The windows are written in frequency, so they still apply to the full spectrum.
+    """
+    good = np.isfinite(x) & np.isfinite(y)
+    if good.all():
+        return x,y
+    return x[good],y[good]
+
+
+def _cache_key(filename):
+    st = os.stat(filename)
+    return float(st.st_size), float(st.st_mtime)
+
+
+def load_cache(filename):
+    """
+    Return the (x,y) memory-mapped from the sidecar cache of filename,
+    or None if there is no cache or the file has changed (size or mtime) since the cache was written.
+    The cache is an array of shape (2,nchan+1), whose first column is the key.
+    """
+    cachefile = filename+cache_ext
+    if not os.path.exists(cachefile):
+        return None
+    try:
+        data = np.load(cachefile,mmap_mode='r')
+    except Exception:
+        return None
+    if (data.ndim != 2) or (data.shape[0] != 2) or (tuple(data[:,0]) != _cache_key(filename)):
+        return None
+    return data[0,1:], data[1,1:]
+
+
+def save_cache(filename,x,y):
+    """
+    Write the sidecar cache of filename. Failures (e.g., a read-only directory) are ignored.
+    """
+    cachefile = filename+cache_ext
+    data = np.empty((2,len(x)+1),dtype='float64')
+    data[:,0] = _cache_key(filename)
+    data[0,1:] = x
+    data[1,1:] = y
+    #a temporary file of its own for each writer (thread or process), renamed at once when complete
+    tmpfile = None
+    try:
+        fd,tmpfile = tempfile.mkstemp(suffix='.tmp',prefix=os.path.basename(cachefile)+'.',
+                                      dir=os.path.dirname(os.path.abspath(cachefile)))
+        with os.fdopen(fd,'wb') as f:
+            np.save(f,data)
+        os.replace(tmpfile,cachefile)
+    except OSError as e:
+        print('can not write cache %s: %s' %(cachefile,e))
+        if tmpfile is not None:
+            try:
+                os.remove(tmpfile)
+            except OSError:
+                pass
+
+
+def getdata_from_file(filename,cache=True,progress=None):
+    """
+    Read a spectrum file and return (x,y), with x the frequency in MHz in ascending order.
+    The supported formats (by extension, see spectrum_exts) are
+        text (.tsv, .csv, .txt, .dat): see read_text, e.g. the tsv exported by the CASA viewer;
+            the unit of the frequency is taken from the header, GHz by default,
+        FITS (.fits, .fit): a 1D spectrum with a spectral WCS axis, see read_fits_spectrum.
+    Blanked channels are dropped, see finite_channels.
+    With cache, the spectrum of a text file is also written to filename+'.npy', which is memory-mapped
+    by the following reads as long as the file is unchanged.
+    progress is passed to the reader.
+    A ValueError is raised if the file can not be parsed.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in spectrum_exts:
+        raise ValueError('can not parse data file %s' %filename)
+    if ext in ('.fits','.fit'):
+        x,y = read_fits_spectrum(filename,progress=progress)
+    else:
+        if cache:
+            data = load_cache(filename)
+            if data is not None:
+                return data
+        delimiter = ',' if ext == '.csv' else None
+        x,y,header = read_text(filename,delimiter=delimiter,progress=progress)
+        x = x*text_unit_factor(header)
+    x,y = finite_channels(x,y)
+    if len(x)<2:
+        raise ValueError('less than two channels in %s' %filename)
+    if x[1]<x[0]:
+        x = x[::-1]
+        y = y[::-1]
+    if cache and (ext not in ('.fits','.fit')):
+        save_cache(filename,x,y)
+    return x,y
+
+
+def find_spectra(paths):
+    """
+    Expand the directories in paths into the spectrum files they contain, i.e. the files with
+    an extension of spectrum_exts, except the windows files and the outputs of the export.
+    """
+    derived = (winstr_appendstr,winstats_appendstr)+tuple(contsub_appendstr+ext for ext in spectrum_exts)
+    specfiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            specfiles.extend(sorted(f for f in glob.glob(os.path.join(path,'*'))
+                                    if f.lower().endswith(spectrum_exts) and not f.lower().endswith(derived)
+                                    and os.path.isfile(f)))
+        else:
+            specfiles.append(path)
+    return specfiles
+
+
+def read_winstr(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+def nearest_channels(x,values):
+    """
+    The index of the channel nearest to each of values, for an ascending x.
+    This is the same as np.argmin(np.abs(value-x)) (including taking the first channel in a tie),
+    but costs O(log(nchan)) per value.
+    """
+    values = np.asarray(values,dtype='float64')
+    right = np.clip(np.searchsorted(x,values,side='left'),1,len(x)-1)
+    left = right-1
+    dex = np.where(values-x[left] <= x[right]-values, left, right)
+    if len(x) == 1:
+        dex = np.zeros_like(dex)
+    #in case of duplicated frequencies, argmin would return the first one
+    return np.searchsorted(x,x[dex],side='left')
+
+
+def windows_to_mask(edges,nchan):
+    """
+    Build the boolean mask from the (first,last) channels of the windows, which may overlap.
+    """
+    edges = np.asarray(edges,dtype='int64').reshape(-1,2)
+    edges = edges[edges[:,0]<=edges[:,1]]
+    counts = np.bincount(edges[:,0],minlength=nchan+1)-np.bincount(edges[:,1]+1,minlength=nchan+1)
+    return np.cumsum(counts[:nchan])>0
+
+
+def parse_winstr_edges(winstr,x):
+    """
+    Convert a string like 216988.6683~216995.9926;217078.5120~217079.9769
+    into the (first,last) channels of the windows, for an ascending x.
+    Each frequency is snapped to the nearest channel.
+    """
+    wins = np.array([i.split('~') for i in winstr.strip().split(';')],dtype='float64')
+    if wins.ndim != 2 or wins.shape[1] != 2:
+        raise ValueError('can not parse windows string %s' %winstr[:100])
+    #Be carefull that 'win[(x>=i[0]) & (x<=i[1])]=True' performs not good,
+    #since the frequency written to file has been truncated with limited precision.
+    return nearest_channels(x,wins.ravel()).reshape(-1,2)
+
+
+def parse_winstr_windows(winstr,x):
+    """
+    Same as parse_winstr, but return the windows as sorted intervals of channels (see normalise_windows).
+    """
+    return normalise_windows(parse_winstr_edges(winstr,x))
+
+
+def parse_winstr(winstr,x):
+    """
+    Convert a string like 216988.6683~216995.9926;217078.5120~217079.9769
+    into a boolean mask over the channels of x, which should be in ascending order.
+    """
+    return windows_to_mask(parse_winstr_edges(winstr,x),len(x))
+
+
+def parse_mask_edges(mask):
+    """
+    Return the (first,last) channel indices of each window of a boolean mask,
+    as an array of shape (nwin,2).
+    """
+    mask1 = np.zeros(len(mask)+2,dtype='bool')
+    mask1[0]  = False
+    mask1[-1] = False
+    mask1[1:-1] = mask
+    left_edges  = (~mask1[0:-2]) & (mask1[1:-1])
+    right_edges = (mask1[1:-1]) & (~mask1[2:])
+    left_edges = np.arange(len(mask))[left_edges]
+    right_edges = np.arange(len(mask))[right_edges]
+    assert len(left_edges) == len(right_edges)
+    return np.array([left_edges,right_edges]).T
+
+
+def format_windows(windows,x,precision=None):
+    """
+    Write the windows as a string like 216988.6683~216995.9926;217078.5120~217079.9769,
+    with precision decimals (default winstr_precision), or, if precision is negative, the shortest repr
+    of the frequencies, which parse back to exactly the same frequencies.
+    All the frequencies are formatted by a single %-operation.
+    """
+    if len(windows) == 0:
+        return ''
+    precision = winstr_precision if precision is None else precision
+    fmt = '%r~%r;' if precision < 0 else '%%.%if~%%.%if;' %(precision,precision)
+    return ((fmt*len(windows)) % tuple(x[np.asarray(windows)].ravel().tolist()))[:-1]
+
+
+def changed_span(old,new):
+    """
+    Return (start,stop_old,stop_new) such that new == old[:start]+new[start:stop_new]+old[stop_old:],
+    with the common head and tail of the two strings as long as possible,
+    e.g. to update a text widget with only the windows which changed.
+    """
+    a = np.frombuffer(old.encode('utf-32-le'),dtype='uint32')
+    b = np.frombuffer(new.encode('utf-32-le'),dtype='uint32')
+    n = min(len(a),len(b))
+    diff = np.nonzero(a[:n] != b[:n])[0]
+    start = diff[0] if len(diff)>0 else n
+    m = n-start
+    diff = np.nonzero(a[len(a)-m:][::-1] != b[len(b)-m:][::-1])[0] if m>0 else []
+    tail = diff[0] if len(diff)>0 else m
+    return int(start), int(len(a)-tail), int(len(b)-tail)
+
+
+def parse_mask(mask,x,precision=None):
+    """
+    The inverse of parse_winstr.
+    """
+    return format_windows(parse_mask_edges(mask),x,precision=precision)
+
+
+#########################################
+#Windows as intervals of channels.
+#A set of windows is held as an int array of shape (nwin,2) with the (first,last) channels of each window,
+#sorted, non-overlapping and non-adjacent, i.e. exactly what parse_mask_edges returns.
+#Its size grows with the number of windows rather than the number of channels.
+#########################################
+
+def empty_windows():
+    return np.zeros((0,2),dtype='int64')
+
+
+def normalise_windows(edges):
+    """
+    Sort the windows, and merge the overlapping or adjacent ones.
+    """
+    edges = np.asarray(edges,dtype='int64').reshape(-1,2)
+    edges = edges[edges[:,0]<=edges[:,1]]
+    if len(edges) == 0:
+        return empty_windows()
+    edges = edges[np.argsort(edges[:,0],kind='stable')]
+    rmax = np.maximum.accumulate(edges[:,1])
+    start = np.ones(len(edges),dtype='bool')
+    start[1:] = edges[1:,0] > rmax[:-1]+1
+    starts = np.nonzero(start)[0]
+    ends = np.append(starts[1:]-1,len(edges)-1)
+    return np.array([edges[starts,0],rmax[ends]]).T
+
+
+def windows_union(windows,first,last):
+    """
+    Add the channels first..last (inclusive) to the windows.
+    """
+    if first>last:
+        return windows
+    i0 = np.searchsorted(windows[:,1],first-1,side='left')
+    i1 = np.searchsorted(windows[:,0],last+1,side='right')
+    if i0<i1:
+        first = min(first,windows[i0,0])
+        last = max(last,windows[i1-1,1])
+    return np.concatenate([windows[:i0],[[first,last]],windows[i1:]]).astype('int64')
+
+
+def windows_subtract(windows,first,last):
+    """
+    Remove the channels first..last (inclusive) from the windows.
+    """
+    if first>last:
+        return windows
+    i0 = np.searchsorted(windows[:,1],first,side='left')
+    i1 = np.searchsorted(windows[:,0],last,side='right')
+    if i0>=i1:
+        return windows
+    pieces = []
+    if windows[i0,0]<first:
+        pieces.append([windows[i0,0],first-1])
+    if windows[i1-1,1]>last:
+        pieces.append([last+1,windows[i1-1,1]])
+    return np.concatenate([windows[:i0],np.reshape(pieces,(-1,2)),windows[i1:]]).astype('int64')
+
+
+def windows_contain(windows,channels):
+    """
+    Whether each of channels is within the windows.
+    """
+    i = np.searchsorted(windows[:,0],channels,side='right')-1
+    return (i>=0) & (channels <= windows[np.maximum(i,0),1]) if len(windows)>0 else np.zeros(np.shape(channels),dtype='bool')
+
+
+def windows_difference(a,b):
+    """
+    The channels in the windows a but not in the windows b.
+    """
+    if (len(a) == 0) or (len(b) == 0):
+        return a
+    pts = np.unique(np.concatenate([a[:,0],a[:,1]+1,b[:,0],b[:,1]+1]))
+    keep = windows_contain(a,pts[:-1]) & ~windows_contain(b,pts[:-1])
+    return normalise_windows(np.array([pts[:-1][keep],pts[1:][keep]-1]).T)
+
+
+def windows_xor(a,b):
+    """
+    The channels in either the windows a or the windows b but not both, i.e. the run lengths of the XOR
+    of the two masks. windows_xor(a,windows_xor(a,b)) is b.
+    """
+    if len(a) == 0:
+        return b
+    if len(b) == 0:
+        return a
+    pts = np.unique(np.concatenate([a[:,0],a[:,1]+1,b[:,0],b[:,1]+1]))
+    keep = windows_contain(a,pts[:-1]) ^ windows_contain(b,pts[:-1])
+    return normalise_windows(np.array([pts[:-1][keep],pts[1:][keep]-1]).T)
+
+
+def windows_channels(windows):
+    """
+    The indices of all the channels within the windows.
+    """
+    n = windows[:,1]-windows[:,0]+1
+    return np.arange(n.sum())+np.repeat(windows[:,0]-np.cumsum(n)+n,n)
+
+
+def windows_nchan(windows):
+    return int((windows[:,1]-windows[:,0]+1).sum())
+
+
+def channel_range(x,x1,x2,inclusive=False):
+    """
+    The (first,last) channels with x1<x<x2 (or x1<=x<=x2 if inclusive), for an ascending x.
+    first>last if there is none.
+    """
+    if inclusive:
+        return int(np.searchsorted(x,x1,side='left')), int(np.searchsorted(x,x2,side='right'))-1
+    return int(np.searchsorted(x,x1,side='right')), int(np.searchsorted(x,x2,side='left'))-1
+
+
+class SpectralAxis:
+    """
+    The channels of a spectrum (x ascending), built once per spectrum, with the extrema of x and y
+    and the channel step cached, and range lookups of O(1) for a uniform grid, O(log(nchan)) otherwise.
+    The grid is taken as uniform if every channel is within a quarter of a step of x[0]+i*step, in which case
+    a lookup is computed from the step and checked against the one or two channels around it;
+    this touches only a few pages of a memory-mapped x.
+    Usage:
+        axis = SpectralAxis(x,y)
+        axis.xmin, axis.xmax, axis.ymin, axis.ymax, axis.step
+        first,last = axis.channel_range(x1,x2)
+    """
+    chunksize = 2**20
+
+    def __init__(self,x,y):
+        self.x = x
+        self.nchan = len(x)
+        self.xmin = float(x[0])
+        self.xmax = float(x[-1])
+        self.ymin = float(np.nanmin(y))
+        self.ymax = float(np.nanmax(y))
+        self.step = (self.xmax-self.xmin)/max(self.nchan-1,1)
+        self.uniform = self.on_grid(0.25)
+
+    def on_grid(self,tol):
+        """
+        Whether every channel is within tol steps of x[0]+i*step.
+        """
+        if not (self.step > 0):
+            return False
+        for i0 in range(0,self.nchan,self.chunksize):
+            block = self.x[i0:i0+self.chunksize]
+            grid = self.xmin+self.step*np.arange(i0,i0+len(block))
+            if np.abs(block-grid).max() > tol*self.step:
+                return False
+        return True
+
+    def searchsorted(self,value,side='left'):
+        """
+        Same as int(np.searchsorted(x,value,side)).
+        """
+        if not self.uniform:
+            return int(np.searchsorted(self.x,value,side=side))
+        x,n = self.x,self.nchan
+        i = int(min(max(np.ceil((value-self.xmin)/self.step),0),n))
+        #the first i with x[i]>=value (left) or x[i]>value (right)
+        if side == 'left':
+            while (i>0) and (x[i-1] >= value):
+                i -= 1
+            while (i<n) and (x[i] < value):
+                i += 1
+        else:
+            while (i>0) and (x[i-1] > value):
+                i -= 1
+            while (i<n) and (x[i] <= value):
+                i += 1
+        return i
+
+    def channel_range(self,x1,x2,inclusive=False):
+        """
+        Same as channel_range(x,x1,x2,inclusive).
+        """
+        if inclusive:
+            return self.searchsorted(x1,'left'), self.searchsorted(x2,'right')-1
+        return self.searchsorted(x1,'right'), self.searchsorted(x2,'left')-1
+
+
+class WindowsHistory:
+    """
+    The undo history of the windows, as a log of XOR diffs (see windows_xor) between successive entries,
+    with a full copy (keyframe) every keyframe_every entries, or whenever the diff is not smaller than the windows.
+    An entry is rebuilt from the last keyframe before it, found by bisection, plus at most keyframe_every diffs;
+    stepping to the next entry from the last one read costs a single diff.
+    The oldest entries are dropped once the stored arrays take more than budget bytes (the last entry is always kept).
+    It behaves as a read-only list of windows, plus:
+        append(windows), truncate(n), clear(), pop_first()
+    Usage:
+        history = WindowsHistory(budget=16*2**20)
+        history.append(windows)
+        windows = history[-1]
+    """
+    keyframe_every = 32
+    entry_overhead = 100  # bytes counted per entry on top of its array
+
+    def __init__(self,entries=(),budget=16*2**20):
+        self.budget = budget
+        self.start = 0      # absolute index of the first entry
+        self.stop = 0
+        self.data = {}      # absolute index -> windows (keyframe) or diff with the previous entry
+        self.keys = []      # absolute indices of the keyframes, ascending
+        self.nbytes = 0
+        self._cache = None  # (absolute index, windows) of the last entry read
+        for windows in entries:
+            self.append(windows)
+
+    def __len__(self):
+        return self.stop-self.start
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _absolute(self,i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not (0 <= i < n):
+            raise IndexError('history index out of range')
+        return self.start+i
+
+    def __getitem__(self,i):
+        import bisect
+        j = self._absolute(i)
+        k = self.keys[bisect.bisect_right(self.keys,j)-1]
+        if (self._cache is not None) and (k <= self._cache[0] <= j):
+            k,windows = self._cache
+        else:
+            windows = self.data[k]
+        for m in range(k+1,j+1):
+            windows = windows_xor(windows,self.data[m])
+        self._cache = (j,windows)
+        return windows
+
+    def _store(self,j,array,key):
+        import bisect
+        self.data[j] = array
+        self.nbytes += array.nbytes+self.entry_overhead
+        if key:
+            bisect.insort(self.keys,j)
+
+    def _drop(self,j):
+        self.nbytes -= self.data.pop(j).nbytes+self.entry_overhead
+
+    def append(self,windows):
+        windows = np.asarray(windows,dtype='int64').reshape(-1,2)
+        j = self.stop
+        if len(self) == 0:
+            self._store(j,windows,True)
+        else:
+            diff = windows_xor(self[-1],windows)
+            key = (j-self.keys[-1] >= self.keyframe_every) or (len(diff) >= len(windows))
+            self._store(j,windows if key else diff,key)
+        self.stop += 1
+        self._cache = (j,windows)
+        while (self.nbytes > self.budget) and (len(self) > 1):
+            self.pop_first()
+
+    def pop_first(self):
+        if len(self) == 0:
+            raise IndexError('pop from an empty history')
+        j = self.start
+        if (len(self) > 1) and (self.keys[1:2] != [j+1]):
+            #the second entry becomes the first one, so it has to be a keyframe
+            windows = self[1]
+            self._drop(j+1)
+            self._store(j+1,windows,True)
+        self._drop(j)
+        self.keys.pop(0)
+        self.start += 1
+        if (self._cache is not None) and (self._cache[0] < self.start):
+            self._cache = None
+
+    def truncate(self,n):
+        """
+        Keep only the first n entries, e.g. drop the redo entries before appending a new one.
+        """
+        n = max(n,0)
+        while self.stop > self.start+n:
+            self.stop -= 1
+            self._drop(self.stop)
+            if self.keys and self.keys[-1] == self.stop:
+                self.keys.pop()
+        if (self._cache is not None) and (self._cache[0] >= self.stop):
+            self._cache = None
+
+    def clear(self):
+        self.truncate(0)
+        self.start = self.stop = 0
+
+
+def poly_basis(x,fitorder):
+    """
+    The Vandermonde matrix of the frequency normalised to [0,1], with the columns ordered as np.polyfit.
+    """
+    xfit = (x-x.min())/(x.max()-x.min())
+    return np.vander(xfit,fitorder+1)
+
+
+def fit_baseline(x,y,mask,fitorder):
+    """
+    Fit a polynomial of order fitorder to the masked channels, and evaluate it over all channels.
+    The frequency is normalised to [0,1] before fitting.
+    Return None if fitorder is negative or the masked channels are not enough.
+    """
+    if fitorder<0:
+        return None
+    if mask.sum()<=fitorder:
+        print('the channel number is not enough for %i-order poly fitting' %(fitorder) )
+        return None
+    xfit = (x-x.min())/(x.max()-x.min())
+    ppar = np.polyfit(xfit[mask],y[mask],fitorder)
+    return np.polyval(ppar,xfit)
+
+
+class IncrementalFit:
+    """
+    Least-squares polynomial baseline kept up to date with the windows.
+    The normal equations G=L^T L, r=L^T y, with L the Legendre basis (up to maxorder) of the frequency
+    normalised to [-1,1] over the extent of the windows, are accumulated over the channels of the windows.
+    When the windows change within the same extent, only the channels added or removed are accumulated,
+    and a fit of any order up to maxorder is then a (order+1)^2 solve.
+    The fitted polynomial is the same as the one of fit_baseline.
+    Usage:
+        fitter = IncrementalFit(x,y)
+        fitter.set_windows(windows)
+        coef = fitter.solve(fitorder)
+        yfit = fitter.evaluate(coef,x)
+    """
+    refresh_every = 256  # rebuild the sums from scratch after so many updates, against accumulated round-off
+    chunksize = 2**16
+    max_cond = 1E8  # of the normal equations, beyond which the fit is solved from the channels, see direct_solve
+
+    def __init__(self,x,y,maxorder=5):
+        self.x = x
+        self.y = y
+        self.maxorder = maxorder
+        self.reset(x.min(),x.max())
+
+    def reset(self,xmin,xmax):
+        self.xmin, self.xmax = xmin, (xmax if xmax>xmin else xmin+1.)
+        self.windows = empty_windows()
+        self.G = np.zeros((self.maxorder+1,self.maxorder+1))
+        self.r = np.zeros(self.maxorder+1)
+        self.nupdate = 0
+
+    def normalise(self,x):
+        return 2.*(x-self.xmin)/(self.xmax-self.xmin)-1.
+
+    @staticmethod
+    def vander(t,order):
+        # numpy.polynomial.legendre.legvander, with the recurrence computed in place (2-3 times faster)
+        V = np.empty((order+1,len(t)))
+        V[0] = 1.
+        if order > 0:
+            V[1] = t
+        for n in range(1,order):
+            np.multiply(t,V[n],out=V[n+1])
+            V[n+1] *= (2*n+1)/(n+1)
+            V[n+1] -= (n/(n+1))*V[n-1]
+        return V.T
+
+    @staticmethod
+    def val(t,coef):
+        from numpy.polynomial.legendre import legval
+        return legval(t,coef)
+
+    def _accumulate(self,windows,sign):
+        channels = windows_channels(windows)
+        for i0 in range(0,len(channels),self.chunksize):
+            dex = channels[i0:i0+self.chunksize]
+            L = self.vander(self.normalise(self.x[dex]),self.maxorder)
+            self.G += sign*(L.T @ L)
+            self.r += sign*(L.T @ self.y[dex])
+
+    def set_windows(self,windows,maxorder=None):
+        if (maxorder is not None) and (maxorder > self.maxorder):
+            self.maxorder = maxorder
+            self.reset(self.xmin,self.xmax)
+        if len(windows) == 0:
+            self.reset(self.xmin,self.xmax)
+            return
+        xmin, xmax = self.x[windows[0,0]], self.x[windows[-1,1]]
+        added = windows_difference(windows,self.windows)
+        removed = windows_difference(self.windows,windows)
+        if ((xmin,xmax) != (self.xmin,self.xmax)) or (self.nupdate >= self.refresh_every) or \
+           (windows_nchan(added)+windows_nchan(removed) > windows_nchan(windows)):
+            self.reset(xmin,xmax)
+            added, removed = windows, empty_windows()
+        self._accumulate(added,1.)
+        self._accumulate(removed,-1.)
+        self.windows = windows
+        self.nupdate += 1
+
+    def solve(self,fitorder):
+        """
+        Return the Legendre coefficients of the fit, or None if fitorder is negative or the channels are not enough.
+        """
+        if fitorder<0:
+            return None
+        if windows_nchan(self.windows)<=fitorder:
+            print('the channel number is not enough for %i-order poly fitting' %(fitorder) )
+            return None
+        if fitorder > self.maxorder:
+            self.set_windows(self.windows,maxorder=fitorder)
+        n = fitorder+1
+        if np.linalg.cond(self.G[:n,:n]) > self.max_cond:
+            return self.direct_solve(fitorder)
+        return np.linalg.lstsq(self.G[:n,:n],self.r[:n],rcond=None)[0]
+
+    def direct_solve(self,fitorder):
+        """
+        The least squares solved by QR of the basis on the channels of the windows, for the windows (e.g. a few
+        ones far apart) on which the normal equations, whose condition number is the square of that of the basis,
+        lose too many digits. The QR runs over chunks of channels, the R of each chunk being stacked on the next one.
+        """
+        channels = windows_channels(self.windows)
+        n = fitorder+1
+        R = np.zeros((0,n+1))
+        for i0 in range(0,len(channels),self.chunksize):
+            dex = channels[i0:i0+self.chunksize]
+            A = np.empty((len(dex),n+1))
+            A[:,:n] = self.vander(self.normalise(self.x[dex]),fitorder)
+            A[:,n] = self.y[dex]
+            R = np.linalg.qr(np.vstack([R,A]),mode='r')
+        return np.linalg.lstsq(R[:n,:n],R[:n,n],rcond=None)[0]
+
+    def evaluate(self,coef,x):
+        return self.val(self.normalise(np.asarray(x)),coef)
+
+
+class ChebyshevFit(IncrementalFit):
+    """
+    IncrementalFit in the Chebyshev basis.
+    """
+    @staticmethod
+    def vander(t,order):
+        from numpy.polynomial.chebyshev import chebvander
+        return chebvander(t,order)
+
+    @staticmethod
+    def val(t,coef):
+        from numpy.polynomial.chebyshev import chebval
+        return chebval(t,coef)
+
+
+class RobustFit(IncrementalFit):
+    """
+    Polynomial baseline fitted by iteratively reweighted least squares, with the Tukey biweight of the residuals
+    in units of their scaled MAD, so that the faint lines left in the windows do not pull the baseline.
+    The iterations start from the least-squares fit of IncrementalFit, and run on a subsample of about nscale
+    channels spread over the windows; the baseline is then solved once on all the channels of the windows, with
+    the weights of the converged subsample fit, in chunks of chunksize channels whose basis stays in the cache.
+    Each solve is a weighted Legendre least squares, from the weighted products of the basis (V.T w V),
+    which are nearly orthogonal on the windows.
+    """
+    tukey_c = 4.685
+    maxiter = 10
+    tol = 1E-4  # on the change of the baseline, in units of the scale of the residuals
+    nscale = 2**16
+    chunksize = 2**12
+
+    def tukey_weights(self,res,scale,out):
+        #w = (1-u^2)^2 for |u|<1, 0 otherwise, with u = res/(c*scale), in place
+        np.multiply(res,1./(self.tukey_c*scale),out=out)
+        np.square(out,out=out)
+        np.subtract(1.,out,out=out)
+        np.clip(out,0.,None,out=out)
+        np.square(out,out=out)
+        return out
+
+    def weighted_solve(self,V,y,w):
+        G = 0.
+        r = 0.
+        for i0 in range(0,len(y),self.chunksize):
+            Vw = V[i0:i0+self.chunksize]*w[i0:i0+self.chunksize,None]
+            G = G+V[i0:i0+self.chunksize].T@Vw
+            r = r+Vw.T@y[i0:i0+self.chunksize]
+        return np.linalg.solve(G,r)
+
+    def full_solve(self,channels,coef,scale):
+        fitorder = len(coef)-1
+        G = np.zeros((fitorder+1,fitorder+1))
+        r = np.zeros(fitorder+1)
+        for i0 in range(0,len(channels),self.chunksize):
+            dex = channels[i0:i0+self.chunksize]
+            V = self.vander(self.normalise(self.x[dex]),fitorder)
+            y = self.y[dex]
+            res = y-V@coef
+            Vw = V*self.tukey_weights(res,scale,res)[:,None]
+            G += V.T@Vw
+            r += Vw.T@y
+        return np.linalg.solve(G,r)
+
+    def solve(self,fitorder):
+        coef = IncrementalFit.solve(self,fitorder)
+        if coef is None:
+            return None
+        channels = windows_channels(self.windows)
+        step = max(len(channels)//self.nscale,1)
+        sample = channels[::step]
+        V = self.vander(self.normalise(self.x[sample]),fitorder)
+        y = self.y[sample]
+        w = np.empty(len(y))
+        scale = 0.
+        for i in range(self.maxiter):
+            res = y-V@coef
+            scale = 1.4826*np.median(np.abs(res))
+            if scale == 0:
+                return coef
+            new = self.weighted_solve(V,y,self.tukey_weights(res,scale,w))
+            #the basis is bounded by 1 on [-1,1], so the change of the coefficients bounds that of the baseline
+            done = np.abs(new-coef).sum() <= self.tol*scale
+            coef = new
+            if done:
+                break
+        if step > 1:
+            coef = self.full_solve(channels,coef,scale)
+        return coef
+
+
+def solve_banded_spd(ab,b):
+    """
+    Solve A c = b for a symmetric positive definite band matrix A, given by its diagonal and upper bands
+    ab[d,i] = A[i,i+d], with the banded Cholesky factorisation A = U^T U, in O(n w^2) for w bands.
+    """
+    w = ab.shape[0]-1
+    n = ab.shape[1]
+    a = ab.tolist()
+    u = [[0.]*n for d in range(w+1)]  # u[d][i] = U[i,i+d]
+    for i in range(n):
+        s = a[0][i]-sum(u[i-k][k]**2 for k in range(max(0,i-w),i))
+        if s <= 0:
+            raise np.linalg.LinAlgError('the matrix is not positive definite')
+        u[0][i] = s**0.5
+        for j in range(i+1,min(n,i+w+1)):
+            s = a[j-i][i]-sum(u[i-k][k]*u[j-k][k] for k in range(max(0,j-w),i))
+            u[j-i][i] = s/u[0][i]
+    z = [0.]*n
+    for i in range(n):
+        z[i] = (b[i]-sum(u[i-k][k]*z[k] for k in range(max(0,i-w),i)))/u[0][i]
+    c = [0.]*n
+    for i in range(n-1,-1,-1):
+        c[i] = (z[i]-sum(u[j-i][i]*c[j] for j in range(i+1,min(n,i+w+1))))/u[0][i]
+    return np.array(c)
+
+
+class SegmentFit:
+    """
+    Base of the baselines defined over nseg equal segments of the extent of the windows,
+    with the interface of IncrementalFit (set_windows, solve, evaluate), but fitted from scratch at each solve.
+    """
+    def __init__(self,x,y,nseg=8):
+        self.x = x
+        self.y = y
+        self.nseg = max(int(nseg),1)
+        self.windows = empty_windows()
+        self.xmin, self.xmax = x.min(), x.max()
+
+    def set_windows(self,windows,maxorder=None):
+        self.windows = windows
+        if len(windows) > 0:
+            xmin, xmax = self.x[windows[0,0]], self.x[windows[-1,1]]
+            self.xmin, self.xmax = xmin, (xmax if xmax>xmin else xmin+1.)
+
+    def locate(self,x):
+        """
+        Return the segment of each frequency, and the position in the segment normalised to [-1,1]
+        (beyond it for the frequencies out of the extent of the windows).
+        """
+        t = (np.asarray(x)-self.xmin)/(self.xmax-self.xmin)*self.nseg
+        k = np.clip(np.floor(t).astype('int64'),0,self.nseg-1)
+        return k, 2.*(t-k)-1.
+
+    def window_data(self):
+        # the channels of the windows are in ascending order, so sorted by segment
+        channels = windows_channels(self.windows)
+        k,t = self.locate(self.x[channels])
+        return k, t, self.y[channels]
+
+
+class PiecewiseFit(SegmentFit):
+    """
+    An independent polynomial (Legendre basis) in each segment, each one solved by least squares on the Legendre
+    basis of its channels. The segments with too few channels in the windows are left without baseline (NaN).
+    """
+    def solve(self,fitorder):
+        from numpy.polynomial.legendre import legvander
+        if fitorder<0:
+            return None
+        k,t,y = self.window_data()
+        bounds = np.searchsorted(k,np.arange(self.nseg+1))
+        coef = np.full((self.nseg,fitorder+1),np.nan)
+        for i in range(self.nseg):
+            i0,i1 = bounds[i],bounds[i+1]
+            if i1-i0 > fitorder:
+                coef[i] = np.linalg.lstsq(legvander(t[i0:i1],fitorder),y[i0:i1],rcond=None)[0]
+        if np.isnan(coef[:,0]).all():
+            print('the channel number is not enough for %i-order poly fitting in any segment' %(fitorder) )
+            return None
+        return coef
+
+    def evaluate(self,coef,x):
+        k,t = self.locate(x)
+        #the Legendre recurrence, with the coefficients of the segment of each frequency
+        p0,p1 = np.ones_like(t),t
+        yfit = coef[k,0]*p0
+        for n in range(1,coef.shape[1]):
+            yfit = yfit+coef[k,n]*p1
+            p0,p1 = p1,((2*n+1)*t*p1-n*p0)/(n+1)
+        return yfit
+
+
+class SplineFit(SegmentFit):
+    """
+    A cubic spline with nseg uniform segments (nseg+3 B-spline coefficients), least-squares fitted to the channels
+    of the windows. Each channel has 4 non-zero B-splines (between 0 and 1), whose products are accumulated with
+    bincount into the normal equations: the B-splines of a segment overlap only those of the next 3 segments,
+    so they are a well-conditioned band matrix, solved by solve_banded_spd. A small penalty on the second differences
+    of the coefficients (a P-spline) bridges the segments without channel, e.g. over a wide line.
+    The spline is always cubic: a fitorder given to solve only turns the baseline off when negative.
+    """
+    penalty = 1E-6  # relative to the mean of the diagonal of the normal equations
+
+    @staticmethod
+    def bsplines(t):
+        # the 4 uniform cubic B-splines of a segment, at u = (t+1)/2 in [0,1]
+        u = (t+1.)/2.
+        v = 1.-u
+        u3 = u*u*u
+        return (v*v*v/6., (3.*u3-6.*u*u+4.)/6., (-3.*u3+3.*u*u+3.*u+1.)/6., u3/6.)
+
+    def solve(self,fitorder=3):
+        if fitorder<0:
+            return None
+        channels = windows_channels(self.windows)
+        if len(channels) < 4:
+            print('the channel number is not enough for spline fitting')
+            return None
+        k,t,y = self.window_data()
+        b = self.bsplines(t)
+        n = self.nseg+3
+        ab = np.zeros((4,n))
+        rhs = np.zeros(n)
+        for i in range(4):
+            rhs += np.bincount(k+i,b[i]*y,minlength=n)
+            for j in range(i,4):
+                ab[j-i] += np.bincount(k+i,b[i]*b[j],minlength=n)
+        lam = self.penalty*max(ab[0].mean(),1E-300)
+        d2 = np.zeros((3,n))  # D^T D of the second differences D
+        d2[0,:-2] += 1.
+        d2[0,1:-1] += 4.
+        d2[0,2:] += 1.
+        d2[1,:-2] -= 2.
+        d2[1,1:-1] -= 2.
+        d2[2,:-2] += 1.
+        ab[:3] += lam*d2
+        return solve_banded_spd(ab,rhs)
+
+    def evaluate(self,coef,x):
+        k,t = self.locate(x)
+        b = self.bsplines(t)
+        return b[0]*coef[k]+b[1]*coef[k+1]+b[2]*coef[k+2]+b[3]*coef[k+3]
+
+
+fitters = {'leg':IncrementalFit,'cheb':ChebyshevFit,'robust':RobustFit,'piece':PiecewiseFit,'spline':SplineFit}
+
+
+def parse_fitspec(spec):
+    """
+    Parse the text of the fit order entry of the GUI, and return (kind,fitorder,nseg) (see make_fitter),
+    or None for no baseline (an empty or negative entry). e.g.
+        '3' or 'leg3': polynomial of order 3 (Legendre basis, see IncrementalFit)
+        'cheb3': the same in the Chebyshev basis
+        'robust3': polynomial of order 3 fitted by iteratively reweighted least squares
+        'piece3/8': a polynomial of order 3 in each of 8 segments
+        'spline20': a cubic spline of 20 segments
+    A ValueError is raised if spec can not be parsed.
+    """
+    import re
+    spec = spec.strip().lower()
+    if (spec == '') or spec.startswith('-'):
+        return None
+    match = re.fullmatch(r'([a-z]*)(\d+)(?:/(\d+))?',spec)
+    if (match is None) or ((match.group(1) or 'leg') not in fitters):
+        raise ValueError('can not parse the fit %s, e.g. 3, leg3, cheb3, robust3, piece3/8, spline20' %spec)
+    kind,number,nseg = match.group(1) or 'leg', int(match.group(2)), match.group(3)
+    if kind == 'piece':
+        if nseg is None:
+            raise ValueError('the number of segments of %s is missing, e.g. piece3/8' %spec)
+        return kind, number, max(int(nseg),1)
+    if nseg is not None:
+        raise ValueError('only the piecewise fits have segments, e.g. piece3/8')
+    if kind == 'spline':
+        return kind, 3, max(number,1)
+    return kind, number, 1
+
+
+def make_fitter(kind,x,y,nseg=1):
+    """
+    A baseline fitter of the given kind (a key of fitters), with the interface of IncrementalFit.
+    """
+    cls = fitters[kind]
+    if issubclass(cls,SegmentFit):
+        return cls(x,y,nseg=nseg)
+    return cls(x,y)
+
+
+#########################################
+#Automatic selection of the line-free channels.
+#The noise is estimated from the channel-to-channel differences, which are hardly affected by lines
+#wider than a few channels, and a channel is taken as line-free if it deviates from the baseline
+#by less than nsigma times the noise. The line channels are then padded on both sides by pad channels.
+#The strict case keeps only the cleanest channels, the loose case accepts more.
+#########################################
+
+autocase_params = {'strict':dict(nsigma=4.,pad=5),
+                   'loose':dict(nsigma=6.,pad=3)}
+
+
+def noise_std(y):
+    """
+    The noise of y, from the MAD of the differences of the adjacent channels, or from their rms if most of them
+    are equal (e.g. a quantized spectrum), for which the MAD is 0.
+    """
+    d = np.diff(y[np.isfinite(y)])
+    if len(d) == 0:
+        return 0.
+    mad = np.median(np.abs(d-np.median(d)))
+    if mad > 0:
+        return 1.4826*mad/np.sqrt(2)
+    return np.sqrt(np.mean(d*d)/2)
+
+
+def clip_limit(y,nsigma):
+    """
+    The largest deviation from the baseline of a line-free channel: nsigma times the noise, but not less than
+    the rounding errors of the baseline, so that a noiseless (e.g. flat) spectrum is all line-free.
+    """
+    finite = np.isfinite(y)
+    scale = np.abs(y[finite]).max() if finite.any() else 0.
+    return max(nsigma*noise_std(y),1E4*np.finfo('float64').eps*scale)
+
+
+def running_median(y,width=201,step=None):
+    """
+    The median of y over a running window of width channels.
+    It is evaluated every step (default width//8) channels and linearly interpolated in between,
+    which costs O(nchan*width/step) instead of O(nchan*width).
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+    half = max(int(width)//2,1)
+    if step is None:
+        step = max(half//4,1)
+    ypad = np.pad(y,half,mode='edge')
+    centers = np.arange(0,len(y),step)
+    if centers[-1] != len(y)-1:
+        centers = np.append(centers,len(y)-1)
+    windows = sliding_window_view(ypad,2*half+1)[centers]
+    return np.interp(np.arange(len(y)),centers,np.nanmedian(windows,axis=1))
+
+
+def pad_lines(linefree,pad):
+    """
+    Widen every line (i.e. every run of False in linefree) by pad channels on both sides.
+    """
+    if pad <= 0:
+        return linefree
+    lines = parse_mask_edges(~linefree)
+    lines[:,0] -= pad
+    lines[:,1] += pad
+    return ~windows_to_mask(np.clip(lines,0,len(linefree)-1),len(linefree))
+
+
+def linefree_sigmaclip(x,y,nsigma=4.,pad=5,fitorder=1,maxiter=30):
+    """
+    Iteratively fit the polynomial baseline to the line-free channels, and reject the channels
+    deviating from it by more than nsigma times the noise, until the line-free channels do not change.
+    """
+    limit = clip_limit(y,nsigma)
+    mask = np.isfinite(y)
+    for i in range(maxiter):
+        yfit = fit_baseline(x,y,mask,max(fitorder,0))
+        if yfit is None:
+            break
+        new = pad_lines(np.abs(y-yfit) <= limit, pad)
+        if (new == mask).all() or (new.sum() <= fitorder):
+            mask = new
+            break
+        mask = new
+    return mask
+
+
+def linefree_runmed(y,nsigma=4.,pad=5,width=501):
+    """
+    The faster variant, taking a running median as the baseline. It follows a baseline of any shape,
+    but also the lines broader than about width/2 channels.
+    """
+    baseline = running_median(y,width=width)
+    return pad_lines(np.abs(y-baseline) <= clip_limit(y,nsigma), pad)
+
+
+def auto_windows(x,y,case='strict',method='sigmaclip',fitorder=1,**kw):
+    """
+    Propose the line-free windows of a spectrum.
+    case: 'strict' or 'loose', see autocase_params. Keyword arguments (nsigma, pad, ...) override them.
+    method: 'sigmaclip' (against the polynomial baseline of order fitorder) or 'runmed' (against a running median)
+    """
+    params = dict(autocase_params[case])
+    params.update(kw)
+    if method == 'sigmaclip':
+        mask = linefree_sigmaclip(x,y,fitorder=fitorder,**params)
+    elif method == 'runmed':
+        mask = linefree_runmed(y,**params)
+    else:
+        raise ValueError('unknown method %s' %method)
+    return parse_mask_edges(mask)
+
+
+def save_winstr(filename,windows,x,precision=None):
+    with open(filename,'w') as f:
+        print('prepare to write to %s' %filename)
+        f.write(format_windows(windows,x,precision=precision))
+
+
+#########################################
+#Session files.
+#A session is written as an uncompressed .npz, i.e. a zip of .npy members stored as they are, so that the
+#spectrum can be memory-mapped straight from the zip on loading (np.load does not memory-map .npz members).
+#The windows are kept as channels, so a session is restored exactly, with its undo history.
+#The history of every spectrum of a multi-spectrum review is kept as well, the first one being the shown spectrum.
+#########################################
+
+session_version = 1
+session_appendstr = '_session.npz'
+
+
+def pack_histories(histories):
+    """
+    Pack a list of histories (each one a list of windows arrays) into three arrays:
+    the concatenated windows, the number of windows of each snapshot, and the number of snapshots of each history.
+    """
+    snapshots = [np.asarray(w,dtype='int64').reshape(-1,2) for h in histories for w in h]
+    windows = np.concatenate(snapshots+[empty_windows()])
+    nwin = np.array([len(w) for w in snapshots],dtype='int64')
+    nsnap = np.array([len(h) for h in histories],dtype='int64')
+    return windows, nwin, nsnap
+
+
+def unpack_histories(windows,nwin,nsnap):
+    ends = np.cumsum(nwin)
+    snapshots = [np.array(w) for w in np.split(np.asarray(windows),ends[:-1])] if len(nwin)>0 else []
+    ends = np.cumsum(nsnap)
+    return [snapshots[i1-n:i1] for n,i1 in zip(nsnap,ends)]
+
+
+def save_session(filename,x,y,specfile='',windows=None,history=(),history_current=-1,fitorder=-1,xlim=None,
+                 states=None,session_files=(),session_index=-1,fitspec=''):
+    """
+    Write a session file, see load_session.
+    states holds the (windows,history,history_current) of the other spectra of a review, by spectrum file.
+    fitspec is the text of the fit order entry (see parse_fitspec), fitorder its order.
+    The file is written next to filename first and then moved, so an interrupted save does not destroy the previous one.
+    """
+    states = {} if states is None else states
+    specfiles = [specfile]+list(states)
+    currents = [history_current]+[states[f][2] for f in states]
+    masks = [windows]+[states[f][0] for f in states]
+    hist_windows,hist_nwin,hist_nsnap = pack_histories([list(history)]+[list(states[f][1]) for f in states])
+    mask_windows,mask_nwin,_ = pack_histories([[empty_windows() if w is None else w for w in masks]])
+    arrays = dict(version=np.array(session_version),
+                  x=np.asarray(x,dtype='float64'),
+                  y=np.asarray(y,dtype='float64'),
+                  specfiles=np.array(specfiles,dtype='U'),
+                  has_mask=np.array([w is not None for w in masks]),
+                  mask_windows=mask_windows,
+                  mask_nwin=mask_nwin,
+                  hist_windows=hist_windows,
+                  hist_nwin=hist_nwin,
+                  hist_nsnap=hist_nsnap,
+                  hist_current=np.array(currents,dtype='int64'),
+                  fitorder=np.array(fitorder),
+                  fitspec=np.array(fitspec,dtype='U'),
+                  xlim=np.array([np.nan,np.nan] if xlim is None else xlim,dtype='float64'),
+                  session_files=np.array(list(session_files),dtype='U'),
+                  session_index=np.array(session_index))
+    tmpfile = '%s.%i.tmp' %(filename,os.getpid())
+    with open(tmpfile,'wb') as f:
+        np.savez(f,**arrays)
+    os.replace(tmpfile,filename)
+
+
+def load_npz(filename,mmap_keys=()):
+    """
+    Read the arrays of an .npz file, memory-mapping the members in mmap_keys if they are stored uncompressed.
+    """
+    import zipfile
+    import struct
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename,'rb') as f:
+        for info in zf.infolist():
+            key = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if (key in mmap_keys) and (info.compress_type == zipfile.ZIP_STORED):
+                #the member data follows its local header of 30 bytes, its name and its extra field
+                f.seek(info.header_offset+26)
+                namelen,extralen = struct.unpack('<HH',f.read(4))
+                f.seek(info.header_offset+30+namelen+extralen)
+                version = np.lib.format.read_magic(f)
+                if version == (1,0):
+                    shape,fortran,dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape,fortran,dtype = np.lib.format.read_array_header_2_0(f)
+                arrays[key] = np.memmap(filename,dtype=dtype,mode='r',shape=shape,
+                                        order='F' if fortran else 'C',offset=f.tell())
+            else:
+                with zf.open(info) as member:
+                    arrays[key] = np.lib.format.read_array(member)
+    return arrays
+
+
+def load_session(filename):
+    """
+    Read a session file written by save_session, and return a dict with
+    x, y (memory-mapped), specfile, windows (None if no window), history, history_current,
+    fitorder, fitspec ('' if not saved), xlim (None if not saved), states, session_files and session_index.
+    A ValueError is raised if the file is not a session file of a known version.
+    """
+    try:
+        a = load_npz(filename,mmap_keys=('x','y'))
+    except Exception as e:
+        raise ValueError('can not read session file %s: %s' %(filename,e))
+    if ('version' not in a) or (int(a['version']) > session_version):
+        raise ValueError('%s is not a session file of version <= %i' %(filename,session_version))
+    specfiles = [str(f) for f in a['specfiles']]
+    histories = unpack_histories(a['hist_windows'],a['hist_nwin'],a['hist_nsnap'])
+    masks = unpack_histories(a['mask_windows'],a['mask_nwin'],[len(specfiles)])[0]
+    masks = [w if has else None for w,has in zip(masks,a['has_mask'])]
+    currents = [int(c) for c in a['hist_current']]
+    xlim = (float(a['xlim'][0]),float(a['xlim'][1])) if np.isfinite(a['xlim']).all() else None
+    return dict(x=a['x'],y=a['y'],
+                specfile=specfiles[0],
+                windows=masks[0],
+                history=histories[0],
+                history_current=currents[0],
+                fitorder=int(a['fitorder']),
+                fitspec=str(a['fitspec']) if 'fitspec' in a else '',
+                xlim=xlim,
+                states={f:(w,h,c) for f,w,h,c in zip(specfiles[1:],masks[1:],histories[1:],currents[1:])},
+                session_files=[str(f) for f in a['session_files']],
+                session_index=int(a['session_index']))
+
+
+def window_spans(windows,x):
+    """
+    The vertices (nwin,4,2) of one rectangle per window, from x[first] to x[last],
+    with y from 0 to 1 in axes coordinates.
+    """
+    verts = np.zeros((len(windows),4,2))
+    verts[:,0:2,0] = x[windows[:,0]][:,None]
+    verts[:,2:4,0] = x[windows[:,1]][:,None]
+    verts[:,1:3,1] = 1.
+    return verts
+
+
+def add_window_spans(ax,windows,x,alpha=0.4,color='gray'):
+    """
+    Shadow the windows with a single PolyCollection of 4 vertices per window, instead of a
+    fill_between over all the channels. It spans the full height of ax whatever the ylim.
+    """
+    from matplotlib.collections import PolyCollection
+    spans = PolyCollection(window_spans(windows,x),transform=ax.get_xaxis_transform(),
+                           facecolor=color,edgecolor='none',alpha=alpha)
+    ax.add_collection(spans,autolim=False)
+    return spans
+
+
+def plot_spectrum(ax,x,y,windows=None,yfit=None,alpha=0.4,color='gray'):
+    """
+    Draw the spectrum, the shadow of the windows and the fitted baseline in the same way as the GUI.
+    """
+    ax.plot(x,y,color='C0')
+    dy = (y.max()-y.min())*0.02
+    ax.set_xlim(x.min(),x.max())
+    ax.set_ylim(y.min()-dy,y.max()+dy)
+    if windows is not None:
+        add_window_spans(ax,windows,x,alpha=alpha,color=color)
+    if yfit is not None:
+        ax.plot(x,yfit,color='r',alpha=0.3,ls='--')
+
+
+def new_figure(figsize=(20,4)):
+    """
+    A figure that does not need any GUI backend.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    fig.add_axes([0.05,0.1,0.9,0.85])
+    return fig
+
+
+def save_figure(pdffilename,x,y,windows=None,yfit=None,fig=None):
+    """
+    Save a snapshot like the one of the GUI. Passing the same fig for many spectra avoids creating a new figure each time.
+    """
+    if fig is None:
+        fig = new_figure()
+    ax = fig.axes[0]
+    ax.clear()
+    plot_spectrum(ax,x,y,windows=windows,yfit=yfit)
+    fig.savefig(pdffilename)
+
+
+def process_spectrum(specfile,winstr=None,outfile=None,fitorder=-1,savepdf=True,fig=None,
+                     auto=None,case='strict',precision=None):
+    """
+    Apply a window string to a spectrum file, and write the windows file (and the pdf snapshot).
+    The windows are snapped to the channels of the spectrum, as done by the GUI.
+    If winstr is None, the windows are selected automatically with the method auto (see auto_windows).
+    precision is passed to format_windows.
+    Return the name of the windows file written.
+    """
+    x,y = getdata_from_file(specfile)
+    if winstr is not None:
+        windows = parse_winstr_windows(winstr,x)
+    else:
+        windows = auto_windows(x,y,case=case,method=auto,fitorder=max(fitorder,1))
+    if outfile is None:
+        outfile = os.path.splitext(specfile)[0]+winstr_appendstr
+    save_winstr(outfile,windows,x,precision=precision)
+    if savepdf:
+        mask = windows_to_mask(windows,len(x))
+        yfit = fit_baseline(x,y,mask,fitorder)
+        save_figure(os.path.splitext(outfile)[0]+'.pdf',x,y,windows=windows,yfit=yfit,fig=fig)
+    return outfile
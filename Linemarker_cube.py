@@ -0,0 +1,327 @@
+#!python
+#########################################
+#Continuum subtraction of a spectral cube with the windows selected by the linemarker.
+#The same polynomial baseline as the GUI is fitted to the masked channels of every
+#spatial pixel, and the pixels are distributed over a pool of processes which share
+#the input cube through shared memory and write into memory-mapped output files.
+#e.g.
+#   $ python Linemarker_cube.py cube.fits --winfile spw0_strict_winstr.txt --fitorder 1 --nproc 8
+#########################################
+
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+from multiprocessing import Pool, shared_memory
+
+import Linemarker_core as core
+
+
+def open_cube(filename):
+    """
+    Open a FITS cube with memory mapping.
+    Return (x,data,hdul,spec_axis), where x is the frequency (MHz) of the channels,
+    data is the cube with degenerate axes (e.g., stokes) removed and the spectral axis moved to the front,
+    i.e. in the shape of (nchan,ny,nx), hdul is the opened HDUList with the cube in hdul[0],
+    and spec_axis is the numpy axis of the spectral axis of hdul[0].data.
+    hdul is to be closed once done with data, e.g. "with hdul:".
+    """
+    import astropy.io.fits as fits
+    hdul = fits.open(filename,memmap=True)
+    try:
+        x,data,spec_axis = cube_axes(hdul[0],filename)
+    except Exception:
+        hdul.close()
+        raise
+    return x,data,hdul,spec_axis
+
+
+def cube_axes(hdu,filename):
+    """
+    (x,data,spec_axis) of the cube in hdu, see open_cube.
+    """
+    from astropy.wcs import WCS
+    wcs = WCS(hdu.header)
+    if not wcs.has_spectral:
+        raise ValueError('no spectral axis found in %s' %filename)
+    spec_axis = hdu.data.ndim-1-wcs.wcs.spec
+    nchan = hdu.data.shape[spec_axis]
+    x = core.spectral_axis_mhz(wcs,nchan)
+    data = np.moveaxis(hdu.data,spec_axis,0)
+    data = data.reshape((nchan,)+tuple(n for n in data.shape[1:] if n!=1))
+    if data.ndim != 3:
+        raise ValueError('%s is not a cube' %filename)
+    return x,data,spec_axis
+
+
+def parse_box(box,ny,nx):
+    """
+    The pixel box 'blcx,blcy,trcx,trcy' (0-based and inclusive, as the box of CASA) as slices (ys,xs),
+    or the whole image for None or ''.
+    """
+    if (box is None) or (box.strip() == ''):
+        return slice(0,ny),slice(0,nx)
+    try:
+        x0,y0,x1,y1 = [int(v) for v in box.replace(' ','').split(',')]
+    except ValueError:
+        raise ValueError('can not parse the box "%s", expected blcx,blcy,trcx,trcy' %box)
+    x0,x1 = max(min(x0,x1),0),min(max(x0,x1),nx-1)
+    y0,y1 = max(min(y0,y1),0),min(max(y0,y1),ny-1)
+    if (x0>x1) or (y0>y1):
+        raise ValueError('the box "%s" is out of the image of %ix%i pixels' %(box,nx,ny))
+    return slice(y0,y1+1),slice(x0,x1+1)
+
+
+def read_pixel_mask(filename,shape):
+    """
+    A pixel mask of the image shape (ny,nx) from a FITS image, true where finite and non-zero.
+    """
+    import astropy.io.fits as fits
+    data = np.squeeze(fits.getdata(filename))
+    if data.shape != tuple(shape):
+        raise ValueError('the mask %s of shape %s does not match the image of shape %s' %(filename,data.shape,tuple(shape)))
+    return np.isfinite(data) & (data != 0)
+
+
+def extract_spectrum(data,box=None,mask=None,stat='mean',chunksize=2**23,progress=None):
+    """
+    The mean or max (stat) spectrum of data (nchan,ny,nx) over the pixels of a box (see parse_box)
+    and/or a boolean pixel mask (ny,nx). NaN pixels are ignored, and a channel without any finite pixel is NaN.
+    The cube is read in blocks of channels of about chunksize values within the box, so a memory-mapped
+    cube larger than the memory only costs one pass over the box.
+    progress, if given, is called with the fraction done after each block, and may raise to abort (see util/loader.py).
+    """
+    if stat not in ('mean','max'):
+        raise ValueError('unknown statistic %s, expected mean or max' %stat)
+    nchan,ny,nx = data.shape
+    ys,xs = parse_box(box,ny,nx)
+    if mask is not None:
+        mask = np.asarray(mask,dtype=bool)[ys,xs]
+        if not mask.any():
+            raise ValueError('no pixel selected by the mask within the box')
+    npix = (ys.stop-ys.start)*(xs.stop-xs.start)
+    step = max(1,chunksize//npix)
+    y = np.empty(nchan,dtype='float64')
+    for c0 in range(0,nchan,step):
+        block = np.asarray(data[c0:c0+step,ys,xs],dtype='float64')
+        block = block.reshape(len(block),-1) if mask is None else block[:,mask]
+        finite = np.isfinite(block)
+        n = finite.sum(axis=1)
+        if stat == 'mean':
+            val = np.where(finite,block,0.).sum(axis=1)/np.maximum(n,1)
+        else:
+            val = np.where(finite,block,-np.inf).max(axis=1)
+        y[c0:c0+step] = np.where(n>0,val,np.nan)
+        if progress is not None:
+            progress(min((c0+step)/nchan,1.))
+    return y
+
+
+def cube_spectrum(filename,box=None,mask=None,stat='mean',progress=None):
+    """
+    Open a cube and extract its spectrum (see extract_spectrum), as getdata_from_file returns it, i.e.
+    (x,y) with x in MHz in ascending order, without the blanked channels. mask may be the file name of a FITS pixel mask.
+    """
+    x,data,hdul,spec_axis = open_cube(filename)
+    with hdul:
+        if isinstance(mask,str):
+            mask = read_pixel_mask(mask,data.shape[1:])
+        y = extract_spectrum(data,box=box,mask=mask,stat=stat,progress=progress)
+        del data
+    x,y = core.finite_channels(x,y)
+    if len(x)<2:
+        raise ValueError('less than two channels with finite values in the region')
+    if (len(x)>1) and (x[1]<x[0]):
+        x,y = x[::-1],y[::-1]
+    return x,y
+
+
+def mask_from_winstr(winstr,x):
+    """
+    parse_winstr assumes an ascending frequency axis, which is not always the case for a cube.
+    """
+    if (len(x)>1) and (x[1]<x[0]):
+        return core.parse_winstr(winstr,x[::-1])[::-1]
+    return core.parse_winstr(winstr,x)
+
+
+def contsub_block(block,mask,A,P):
+    """
+    Subtract the baseline from a block of spectra of shape (nchan,...).
+    A is the basis evaluated at all channels and P the pseudo-inverse of A[mask],
+    so that all the pixels are fitted with a single matrix product.
+    Pixels with NaN within the masked channels are fitted one by one with their finite channels.
+    Return (contsub,continuum) in the shape of block.
+    """
+    nchan = block.shape[0]
+    Y = block.reshape(nchan,-1).astype('float64')
+    coef = P @ Y[mask]
+    cont = A @ coef
+    bad = np.nonzero(~np.isfinite(coef).all(axis=0))[0]
+    for i in bad:
+        good = mask & np.isfinite(Y[:,i])
+        if good.sum() < A.shape[1]:
+            cont[:,i] = np.nan
+        else:
+            cont[:,i] = A @ np.linalg.lstsq(A[good],Y[good,i],rcond=None)[0]
+    return (Y-cont).reshape(block.shape),cont.reshape(block.shape)
+
+
+_shared = {}
+
+def _init_worker(shape,dtype,inname,outfiles,mask,A,P):
+    shm = shared_memory.SharedMemory(name=inname)
+    outs = [np.load(f,mmap_mode='r+') for f in outfiles]
+    _shared.update(shm=shm,cube=np.ndarray(shape,dtype=dtype,buffer=shm.buf),sub=outs[0],
+                   cont=outs[1] if len(outs)>1 else None,
+                   mask=mask,A=A,P=P)
+
+def _contsub_rows(rows):
+    y0,y1 = rows
+    sub,cont = contsub_block(_shared['cube'][:,y0:y1],_shared['mask'],_shared['A'],_shared['P'])
+    _shared['sub'][:,y0:y1] = sub
+    if _shared['cont'] is not None:
+        _shared['cont'][:,y0:y1] = cont
+
+
+def split_rows(ny,nx,nchan,chunksize=2**23):
+    """
+    Split the rows of the cube into pieces of about chunksize values each.
+    """
+    step = max(1,chunksize//max(1,nchan*nx))
+    return [(y0,min(y0+step,ny)) for y0 in range(0,ny,step)]
+
+
+def open_outputs(outfiles,shape,dtype):
+    """
+    New .npy files of the given shape and dtype, opened as memory maps.
+    """
+    return [np.lib.format.open_memmap(f,mode='w+',dtype=dtype,shape=shape) for f in outfiles]
+
+
+def contsub_cube(data,mask,fitorder,x=None,nproc=None,model=False,chunksize=2**23,outfiles=None):
+    """
+    Subtract the polynomial baseline from every spectrum of data (nchan,ny,nx).
+    If outfiles is given (the .npy files of contsub, and of the continuum if model is True), the outputs
+    are memory maps of these files, otherwise arrays in memory.
+    With nproc>1, the rows are fitted by a pool of processes, which read the input from shared memory,
+    so that the cube is never pickled, and write directly into the memory-mapped outputs (of temporary files
+    if outfiles is not given), so that only the input is held in memory, twice at most.
+    Return contsub, or (contsub,continuum) if model is True.
+    """
+    nchan,ny,nx = data.shape
+    if x is None:
+        x = np.arange(nchan,dtype='float64')
+    if mask.sum()<=fitorder:
+        raise ValueError('the channel number is not enough for %i-order poly fitting' %fitorder)
+    A = core.poly_basis(x,fitorder)
+    P = np.linalg.pinv(A[mask])
+    dtype = np.result_type(data.dtype,np.float32)
+    if nproc is None:
+        nproc = os.cpu_count() or 1
+    chunks = split_rows(ny,nx,nchan,chunksize=chunksize)
+
+    if (nproc<=1) or (len(chunks)<=1):
+        if outfiles is not None:
+            outs = open_outputs(outfiles,data.shape,dtype)
+            sub,cont = outs[0],(outs[1] if model else None)
+        else:
+            sub = np.empty(data.shape,dtype=dtype)
+            cont = np.empty(data.shape,dtype=dtype) if model else None
+        for y0,y1 in chunks:
+            _sub,_cont = contsub_block(data[:,y0:y1],mask,A,P)
+            sub[:,y0:y1] = _sub
+            if model:
+                cont[:,y0:y1] = _cont
+        return (sub,cont) if model else sub
+
+    temporary = outfiles is None
+    if temporary:
+        outfiles = []
+        for i in range(2 if model else 1):
+            fd,filename = tempfile.mkstemp(suffix='.npy')
+            os.close(fd)
+            outfiles.append(filename)
+    outs = open_outputs(outfiles,data.shape,dtype)
+    nbytes = int(np.prod(data.shape))*np.dtype(dtype).itemsize
+    shm = shared_memory.SharedMemory(create=True,size=nbytes)
+    try:
+        cube = np.ndarray(data.shape,dtype=dtype,buffer=shm.buf)
+        for y0,y1 in chunks:
+            cube[:,y0:y1] = data[:,y0:y1]
+        initargs = (data.shape,dtype,shm.name,outfiles,mask,A,P)
+        with Pool(nproc,initializer=_init_worker,initargs=initargs) as pool:
+            for _ in pool.imap_unordered(_contsub_rows,chunks):
+                pass
+        del cube
+    finally:
+        shm.close()
+        shm.unlink()
+        if temporary:
+            #the memory maps stay valid after the removal on POSIX systems, elsewhere the files are left behind
+            for filename in outfiles:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+    sub,cont = outs[0],(outs[1] if model else None)
+    return (sub,cont) if model else sub
+
+
+def write_like(filename,data,hdu,spec_axis,overwrite=False):
+    """
+    Write data (nchan,ny,nx) with the header of hdu, restoring the original axes order.
+    """
+    import astropy.io.fits as fits
+    shape = list(hdu.data.shape)
+    shape.insert(0,shape.pop(spec_axis))
+    out = np.moveaxis(data.reshape(shape),0,spec_axis)
+    fits.PrimaryHDU(data=out,header=hdu.header).writeto(filename,overwrite=overwrite)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Subtract a polynomial baseline, fitted to the windows selected by the linemarker, from every pixel of a FITS cube.')
+    parser.add_argument('cube',help='the FITS cube')
+    wingroup = parser.add_mutually_exclusive_group(required=True)
+    wingroup.add_argument('-w','--winfile',help='the windows file')
+    wingroup.add_argument('-s','--winstr',help='the windows string')
+    parser.add_argument('-f','--fitorder',type=int,default=0,help='order of the baseline (default: %(default)s)')
+    parser.add_argument('-o','--out',default=None,help='the continuum subtracted cube (default: CUBE with the suffix .contsub.fits)')
+    parser.add_argument('-m','--model',default=None,help='also write the continuum model to this file')
+    parser.add_argument('-n','--nproc',type=int,default=None,help='number of processes (default: the number of cpus)')
+    parser.add_argument('--overwrite',action='store_true',help='overwrite the outputs')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    winstr = core.read_winstr(args.winfile) if args.winfile is not None else args.winstr
+    x,data,hdul,spec_axis = open_cube(args.cube)
+    mask = mask_from_winstr(winstr,x)
+    out = args.out
+    if out is None:
+        out = os.path.splitext(args.cube)[0]+'.contsub.fits'
+    #the outputs are memory-mapped next to the FITS files, until they are written
+    outfiles = [out+'.tmp.npy'] if args.model is None else [out+'.tmp.npy',args.model+'.tmp.npy']
+    with hdul:
+        hdu = hdul[0]
+        try:
+            if args.model is not None:
+                sub,cont = contsub_cube(data,mask,args.fitorder,x=x,nproc=args.nproc,model=True,outfiles=outfiles)
+                write_like(args.model,cont,hdu,spec_axis,overwrite=args.overwrite)
+                del cont
+            else:
+                sub = contsub_cube(data,mask,args.fitorder,x=x,nproc=args.nproc,outfiles=outfiles)
+            write_like(out,sub,hdu,spec_axis,overwrite=args.overwrite)
+            del sub,data
+        finally:
+            for filename in outfiles:
+                if os.path.exists(filename):
+                    os.remove(filename)
+    print('continuum subtracted cube written to %s' %out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
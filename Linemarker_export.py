@@ -0,0 +1,289 @@
+#!python
+#########################################
+#Export continuum subtracted spectra without the GUI.
+#The polynomial baseline of the GUI (the red dashed line) is fitted to the channels in the windows,
+#and the continuum subtracted spectrum and the baseline model are written block by block,
+#together with the mean and rms of each window in PREFIX_winstats.tsv.
+#With many spectra, the files are distributed over a pool of processes.
+#e.g.
+#   $ python Linemarker_export.py spw*.tsv --winfile common_winstr.txt --fit 1 --format fits
+#   $ python Linemarker_export.py spw*.tsv --winfile common_winstr.txt --fit spline20
+#   $ python Linemarker_export.py data/ --winsuffix _strict_winstr.txt --outdir contsub/ --nproc 8
+#########################################
+
+import os
+import sys
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+import Linemarker_core as core
+
+fits_grid_tol = 1E-6  # in units of the channel step
+
+
+def parse_fit(fit):
+    parsed = core.parse_fitspec(fit)
+    if parsed is None:
+        raise ValueError('a baseline is needed, e.g. 1, cheb3, robust3, piece3/8, spline20')
+    return parsed
+
+
+class Contsub:
+    """
+    The continuum subtracted spectrum, computed in blocks of chunksize channels.
+    Iterating gives (x,y-baseline,baseline) for each block, so that the spectrum (e.g., memory-mapped from the
+    cache of getdata_from_file) is never copied as a whole. The first pass also sums the channels of each window,
+    see window_stats.
+    """
+    def __init__(self,x,y,windows,fit='1',chunksize=2**20):
+        self.x = x
+        self.y = y
+        self.windows = windows
+        self.chunksize = chunksize
+        #the same fit as update_fitline of the GUI, with fit the text of its fit order entry
+        kind,fitorder,nseg = parse_fit(fit)
+        self.fitter = core.make_fitter(kind,x,y,nseg=nseg)
+        self.fitter.set_windows(windows)
+        self.coef = self.fitter.solve(fitorder)
+        if self.coef is None:
+            raise ValueError('%i channels in the windows, not enough for the baseline %s'
+                             %(core.windows_nchan(windows),fit))
+        self.npass = 0
+        self.sums = np.zeros((len(windows),2))
+
+    def __len__(self):
+        return len(self.x)
+
+    def __iter__(self):
+        first = self.npass == 0
+        self.npass += 1
+        for c0 in range(0,len(self.x),self.chunksize):
+            xs = self.x[c0:c0+self.chunksize]
+            base = self.fitter.evaluate(self.coef,xs)
+            sub = self.y[c0:c0+self.chunksize]-base
+            if first:
+                self.add_sums(c0,sub)
+            yield xs,sub,base
+
+    def add_sums(self,c0,sub):
+        w = self.windows
+        c1 = c0+len(sub)
+        i0,i1 = np.searchsorted(w[:,1],c0), np.searchsorted(w[:,0],c1)
+        if i1 <= i0:
+            return
+        starts = np.clip(w[i0:i1,0]-c0,0,len(sub))
+        stops = np.clip(w[i0:i1,1]+1-c0,0,len(sub))
+        for j,v in enumerate((sub,sub*sub)):
+            cs = np.concatenate(([0.],np.cumsum(v)))
+            self.sums[i0:i1,j] += cs[stops]-cs[starts]
+
+    def window_stats(self):
+        """
+        Return an array (nwin,7) of first channel, last channel, first frequency, last frequency (MHz),
+        channel number, mean and rms of the continuum subtracted spectrum of each window.
+        """
+        w = self.windows
+        nchan = (w[:,1]-w[:,0]+1).astype('float64')
+        return np.column_stack((w[:,0],w[:,1],self.x[w[:,0]],self.x[w[:,1]],nchan,
+                                self.sums[:,0]/nchan,np.sqrt(self.sums[:,1]/nchan)))
+
+    def total_rms(self):
+        return np.sqrt(self.sums[:,1].sum()/core.windows_nchan(self.windows))
+
+
+#########################################
+#writers: write(filename,contsub,overwrite) with contsub a Contsub, iterated as many times as needed
+
+def check_overwrite(filename,overwrite):
+    if os.path.exists(filename):
+        if not overwrite:
+            raise FileExistsError('%s exists, see --overwrite' %filename)
+        #also needed for write_fits, as a StreamingHDU appends to an existing file
+        os.remove(filename)
+
+
+def write_tsv(filename,contsub,overwrite=False):
+    """
+    Columns of frequency (MHz), continuum subtracted spectrum and baseline, readable by the linemarker.
+    """
+    check_overwrite(filename,overwrite)
+    with open(filename,'w') as f:
+        f.write('# xLabel: Frequency (MHz)\n# columns: frequency, continuum subtracted, baseline\n')
+        for xs,sub,base in contsub:
+            np.savetxt(f,np.column_stack((xs,sub,base)),fmt='%.15g',delimiter='\t')
+
+
+def write_npy(filename,contsub,overwrite=False):
+    """
+    An array (nchan,3) of frequency (MHz), continuum subtracted spectrum and baseline, written through a memory map.
+    """
+    check_overwrite(filename,overwrite)
+    out = np.lib.format.open_memmap(filename,mode='w+',dtype='float64',shape=(len(contsub),3))
+    i0 = 0
+    for xs,sub,base in contsub:
+        i1 = i0+len(xs)
+        out[i0:i1,0] = xs
+        out[i0:i1,1] = sub
+        out[i0:i1,2] = base
+        i0 = i1
+    out.flush()
+    del out
+
+
+def write_fits(filename,contsub,overwrite=False):
+    """
+    The continuum subtracted spectrum in the primary HDU and the baseline in the extension BASELINE.
+    The frequency axis is in the WCS of the headers if the channels are evenly spaced (within fits_grid_tol
+    of a step), otherwise the frequencies (MHz) are written in a third extension FREQ.
+    Each HDU is streamed to the file in its own pass over the spectrum.
+    """
+    import astropy.io.fits as fits
+    check_overwrite(filename,overwrite)
+    x = contsub.x
+    axis = core.SpectralAxis(x,x)
+    #much tighter than axis.uniform (a quarter of a step), which is only meant for the lookups
+    linear = axis.on_grid(fits_grid_tol)
+    header = fits.Header([('SIMPLE',True),('BITPIX',-64),('NAXIS',1),('NAXIS1',len(x))])
+    if linear:
+        header['CTYPE1'] = 'FREQ'
+        header['CUNIT1'] = 'Hz'
+        header['CRPIX1'] = 1.
+        header['CRVAL1'] = x[0]*1E6
+        header['CDELT1'] = axis.step*1E6
+    hdus = [(None,1),('BASELINE',2)]
+    if not linear:
+        hdus.append(('FREQ',0))
+    for name,column in hdus:
+        #a primary header streamed to an existing file is turned into an extension
+        h = header.copy()
+        if name is not None:
+            h['EXTNAME'] = name
+        if name == 'FREQ':
+            h['BUNIT'] = 'MHz'
+        shdu = fits.StreamingHDU(filename,h)
+        for block in contsub:
+            shdu.write(np.asarray(block[column],dtype='>f8'))
+        shdu.close()
+
+
+writers = {'tsv':(write_tsv,'.tsv'),'npy':(write_npy,'.npy'),'fits':(write_fits,'.fits')}
+
+
+def write_window_stats(filename,contsub,overwrite=False):
+    check_overwrite(filename,overwrite)
+    header = 'columns: first channel, last channel, first frequency (MHz), last frequency (MHz), nchan, mean, rms\n' \
+             'rms of all the windows: %.6g' %contsub.total_rms()
+    np.savetxt(filename,contsub.window_stats(),fmt=['%i','%i','%.15g','%.15g','%i','%.6g','%.6g'],
+               delimiter='\t',header=header)
+
+
+#########################################
+
+def export_spectrum(specfile,winstr=None,outprefix=None,fit='1',fmt='tsv',auto=None,case='strict',
+                    chunksize=2**20,overwrite=False):
+    """
+    Fit the baseline fit (see core.parse_fitspec) to the windows of a spectrum file, and write the continuum subtracted
+    spectrum and the baseline in outprefix+'_contsub'+ext (fmt is 'tsv', 'npy' or 'fits', see the writers),
+    and the statistics of the windows in outprefix+'_winstats.tsv'.
+    If winstr is None, the windows are selected automatically with the method auto (see core.auto_windows).
+    Return the names of the files written.
+    """
+    write,ext = writers[fmt]
+    x,y = core.getdata_from_file(specfile)
+    if winstr is not None:
+        windows = core.parse_winstr_windows(winstr,x)
+    else:
+        windows = core.auto_windows(x,y,case=case,method=auto,fitorder=max(parse_fit(fit)[1],1))
+    contsub = Contsub(x,y,windows,fit,chunksize=chunksize)
+    if outprefix is None:
+        outprefix = os.path.splitext(specfile)[0]
+    outfile = outprefix+core.contsub_appendstr+ext
+    statfile = outprefix+core.winstats_appendstr
+    for filename in (outfile,statfile):
+        check_overwrite(filename,overwrite)
+    write(outfile,contsub,overwrite=overwrite)
+    write_window_stats(statfile,contsub,overwrite=overwrite)
+    return outfile,statfile
+
+
+def _export(task):
+    #run in the pool: the errors are returned, so that one bad spectrum does not stop the others
+    specfile,kw = task
+    try:
+        return specfile,export_spectrum(specfile,**kw),None
+    except Exception as e:
+        return specfile,None,'%s' %e
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Subtract the polynomial baseline fitted to the windows from many spectra, '
+                                     'and write the continuum subtracted spectra, the baselines and the rms of the windows.')
+    parser.add_argument('spectra',nargs='+',help='spectrum files, or directories of spectrum files')
+    wingroup = parser.add_mutually_exclusive_group(required=True)
+    wingroup.add_argument('-w','--winfile',help='one windows file applied to all the spectra')
+    wingroup.add_argument('-s','--winstr',help='one windows string applied to all the spectra')
+    wingroup.add_argument('--winsuffix',help='read the windows of path/specfile.tsv from path/specfile+WINSUFFIX')
+    wingroup.add_argument('--auto',choices=['sigmaclip','runmed'],help='select the line-free windows automatically with this method')
+    parser.add_argument('--case',choices=['strict','loose'],default='strict',help='the case of the automatic selection (default: %(default)s)')
+    parser.add_argument('-f','--fit',default='1',help='the baseline, as in the fit order entry of the GUI, '
+                        'e.g. 1, cheb3, robust3, piece3/8, spline20 (default: %(default)s)')
+    parser.add_argument('--format',choices=sorted(writers),default='tsv',help='format of the continuum subtracted spectra (default: %(default)s)')
+    parser.add_argument('--outdir',default=None,help='directory of the outputs (default: the directory of each spectrum)')
+    parser.add_argument('--chunksize',type=int,default=2**20,help='number of channels processed at once (default: %(default)s)')
+    parser.add_argument('-n','--nproc',type=int,default=None,help='number of processes (default: the number of cpus, at most one per spectrum)')
+    parser.add_argument('--overwrite',action='store_true',help='overwrite the outputs')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    specfiles = core.find_spectra(args.spectra)
+    winstr = None
+    if args.winfile is not None:
+        winstr = core.read_winstr(args.winfile)
+    elif args.winstr is not None:
+        winstr = args.winstr
+    try:
+        parse_fit(args.fit)
+    except ValueError as e:
+        print(e)
+        return 1
+    if args.outdir is not None:
+        os.makedirs(args.outdir,exist_ok=True)
+
+    tasks = []
+    for specfile in specfiles:
+        path_prefix = os.path.splitext(specfile)[0]
+        outdir = os.path.dirname(specfile) if args.outdir is None else args.outdir
+        kw = dict(outprefix=os.path.join(outdir,os.path.basename(path_prefix)),fit=args.fit,
+                  fmt=args.format,auto=args.auto,case=args.case,chunksize=args.chunksize,overwrite=args.overwrite)
+        if args.winsuffix is not None:
+            try:
+                kw['winstr'] = core.read_winstr(path_prefix+args.winsuffix)
+            except Exception as e:
+                print('failed to read the windows of %s: %s' %(specfile,e))
+                continue
+        else:
+            kw['winstr'] = winstr
+        tasks.append((specfile,kw))
+
+    nproc = min(args.nproc or os.cpu_count() or 1,len(tasks))
+    if nproc > 1:
+        with Pool(nproc) as pool:
+            results = list(pool.imap(_export,tasks))
+    else:
+        results = [_export(task) for task in tasks]
+    nfailed = len(specfiles)-len(tasks)
+    for specfile,outfiles,error in results:
+        if error is None:
+            print('%s -> %s' %(specfile,', '.join(outfiles)))
+        else:
+            nfailed += 1
+            print('failed to export %s: %s' %(specfile,error))
+    print('%i of %i spectra exported' %(len(specfiles)-nfailed,len(specfiles)))
+    return 1 if nfailed>0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
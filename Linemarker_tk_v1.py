@@ -7,28 +7,34 @@
 #Other contributors: Xiaofeng Mai
 #########################################
 
-import astropy.io.fits as fits
+#Only what the first window needs is imported here, to keep the cold start short
+#(see benchmarks/bench_startup.py): the figure is embedded without pyplot, astropy is
+#imported by Linemarker_core and Linemarker_cube only to read FITS files, and the selector is created once the window is up.
 import numpy as np
-import matplotlib as mpl
-mpl.use('TkAgg')
-import matplotlib.pyplot as plt
-import astropy.table as t
-from matplotlib.widgets import Button
-from matplotlib.widgets import RectangleSelector
-import matplotlib.patches as patches
-from matplotlib.widgets import TextBox
-from ipywidgets import widgets, interactive
+from matplotlib.figure import Figure
 import os
+import argparse
+import functools
+import concurrent.futures
 
 import tkinter as tk
 from tkinter import ttk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from tkinter import filedialog as fd 
 from tkinter.messagebox import showinfo, askyesno
+from tkinter.simpledialog import askstring
  
 
 import util   
 from util.myscrollbar import MyScrollbar     
+from util.pyramid import MinMaxPyramid
+from util.blitter import Blitter
+from util.instrument import Instrument
+from util.loader import BackgroundLoader
+from util.session import SpectrumSession
+from util.overview import Overview
+from util.watcher import FileWatcher
+import Linemarker_core as core
 
 supporting_language_switch = True
 try:
@@ -50,8 +56,8 @@ class Linemarker:
     of a spectrum.
     Input: 
         Spectrum file:
-            in the format of tsv only (e.g., path/specfile.tsv),
-            the frequency is in unit of MHz,
+            tsv (e.g., path/specfile.tsv), csv, whitespace separated text, or 1D FITS,
+            see Linemarker_core.getdata_from_file,
             not necessary be continuum subtracted.
     Output: 
         Freq windows file: 
@@ -63,9 +69,29 @@ class Linemarker:
         Scroll down: zoom out
         Scroll up: zoom in
         mousewheel click: reset freqency range                    
+    Baseline:
+        the fit order entry takes an order (e.g. 3), or a fitter and its order, e.g. cheb3, robust3,
+        piece3/8 (order 3 in 8 segments), spline20 (cubic spline of 20 segments), see Linemarker_core.parse_fitspec
+    Live reload:
+        run with --watch to reload the spectrum file and its windows file when another program rewrites them,
+        see update_watch
+    Profiling:
+        run with --profile (or LINEMARKER_PROFILE=1) to time the handlers, see util/instrument.py
     """
-    def __init__(self,master,bg='#ECECEC'):
+    #disabled unless an enabled Instrument is given, see _require, _updatecanvas and _blitcanvas
+    instrument = Instrument(enabled=False)
+    mask_history_budget = 16*2**20
+    precision = core.winstr_precision
+    #the baseline fitter, see fitorder_return
+    fitkind = 'leg'
+    fitnseg = 1
+    
+    def __init__(self,master,bg='#ECECEC',instrument=None,precision=None,watch=None):
         self.supporting_language_switch = supporting_language_switch
+        if instrument is not None:
+            self.instrument = instrument
+        if precision is not None:
+            self.precision = precision
         self.master = master
         self.master.config(bg=bg)
         width = self.master.winfo_screenwidth()
@@ -77,16 +103,31 @@ class Linemarker:
         height_app_pad = (height-height_app)//4 
         win_geometry=('%dx%d+%d+%d'%(width_app, height_app,width_app_pad,height_app_pad))
         self.master.geometry(win_geometry)
-        self.fig = plt.figure(_("select line free channel"),figsize=(width_app/dpi,height_app/dpi*2./3))
+        self.fig = Figure(figsize=(width_app/dpi,height_app/dpi*2./3))
+        self.fig.set_label(_("select line free channel"))
         self.ax = self.fig.add_axes([0.05,0.1,0.9,0.85])
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.master)
         self.canvas_widget = self.canvas.get_tk_widget()
         self.canvas_widget.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.blitter = Blitter(self.canvas)
         
         self.scrollbar = MyScrollbar(self.master,orient=tk.HORIZONTAL,command=self.canvascommand)
         self.scrollbar.set(0,0.05)
         self.scrollbar.pack(side=tk.TOP,fill=tk.X,padx=80,pady=(10,2))
         
+        #the whole spectrum with the windows, and the viewport of the main axes, which can be dragged
+        self.overview_fig = Figure(figsize=(width_app/dpi,0.5))
+        self.overview_canvas = FigureCanvasTkAgg(self.overview_fig, master=self.master)
+        self.overview_canvas.get_tk_widget().pack(side=tk.TOP,fill=tk.X)
+        self.overview = Overview(self.overview_fig,command=self.overview_callback,rect=[0.05,0.05,0.9,0.9])
+        
+        if self.instrument.enabled:
+            #the full draws run later (draw_idle), so they are timed apart from the handlers
+            self.canvas.draw = self.instrument.wrap(self.canvas.draw,'canvas.draw',kind='draw')
+            self.status_label = tk.Label(self.master,anchor='w',bg=bg,font=('courier',9))
+            self.status_label.pack(side=tk.BOTTOM,fill=tk.X,padx=80)
+            self.update_status()
+        
         self.line_loaded = False
         spefile = ''#'spw0spe_test1.tsv'
         initial_winfile = 'spw0spe_test1_winstr.txt'
@@ -103,22 +144,22 @@ class Linemarker:
          
         try:
             with open(initial_winfile) as f:
-                self.mask=self.parse_winstr(f.read(),self.x)
+                self.mask=core.parse_winstr_windows(f.read(),self.x)
             self.update_shadow()
         except Exception:
             pass   
-        self.mask_maxhistory = 100
+        #self.mask holds the windows as (first,last) channels of shape (nwin,2), see Linemarker_core,
+        #and the history keeps only the changes between successive windows (core.WindowsHistory),
+        #within mask_history_budget bytes.
         self.reset_mask_history()
         if hasattr(self,'mask'):
             self.append_mask_history(self.mask)  
             
         self.canvas.mpl_connect('scroll_event', self.zoom)
         self.canvas.mpl_connect('button_press_event', self.reset_limit_listen)  
+        self.canvas.mpl_connect('resize_event', self.resize_listen)
         
-        self.selector = RectangleSelector(self.ax, self.draw_callback, useblit=True, 
-                               button=[1, 3], # disable middle button
-                               minspanx=5, minspany=5, spancoords='pixels', 
-                               interactive=False)                 
+        self.master.after_idle(self.create_selector)
        
         self.outframe = tk.Frame(master,bg=bg)
         self.outframe.pack(side=tk.LEFT)               
@@ -150,6 +191,37 @@ class Linemarker:
             font=("Helvetica", 10),
             )
         self.openwin_button.pack(side=tk.TOP,pady=(10,1))   
+        #a session steps through the spectra of a directory (or of the command line), see open_session
+        self.session = None
+        self.opendir_button = tk.Button(self.fileframe,text=_("Open a directory"),command=self.select_directory,
+                                        width=20,font=("Helvetica", 10))
+        self.opendir_button.pack(side=tk.TOP,pady=(10,1))
+        self.opencube_button = tk.Button(self.fileframe,text=_("Open a cube"),command=self.select_cubefile,
+                                         width=20,font=("Helvetica", 10))
+        self.opencube_button.pack(side=tk.TOP,pady=(10,1))
+        self.session_frame = tk.Frame(self.fileframe,bg=bg)
+        self.session_frame.pack(side=tk.TOP)
+        self.session_pre = tk.Button(self.session_frame,text='<',width=3,command=lambda: self.step_spectrum(-1))
+        self.session_pre.pack(side=tk.LEFT)
+        self.session_label = tk.Label(self.session_frame,text='',width=12,bg=bg)
+        self.session_label.pack(side=tk.LEFT)
+        self.session_nex = tk.Button(self.session_frame,text='>',width=3,command=lambda: self.step_spectrum(1))
+        self.session_nex.pack(side=tk.LEFT)
+        self.master.bind('<Prior>',lambda event: self.step_spectrum(-1))
+        self.master.bind('<Next>',lambda event: self.step_spectrum(1))
+        #the files are read in a worker thread, see load_datafile
+        self.loader = BackgroundLoader(self.master)
+        self.progress_value = tk.DoubleVar()
+        self.progressbar = ttk.Progressbar(self.fileframe,orient=tk.HORIZONTAL,length=150,mode='determinate',
+                                           maximum=100,variable=self.progress_value)
+        self.progressbar.pack(side=tk.TOP,pady=(10,1))
+        self.cancel_button = tk.Button(self.fileframe,text=_("cancel"),command=self.cancel_loading,width=12,
+                                       font=("Helvetica", 10),state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.TOP)
+        #with watch (s), the files of the spectrum and of its windows are polled, see update_watch
+        self.watcher = None if watch is None else FileWatcher(self.master,interval=max(int(watch*1000),1))
+        self.winfiles = {}
+        self.watch_spectrum = True  # False for a spectrum extracted from a cube, see set_data
         
         self.fitframe = tk.Frame(master,bg=bg)
         self.fitframe.pack(side=tk.LEFT,padx=20) 
@@ -160,6 +232,13 @@ class Linemarker:
         self.fitorder_entry = tk.Entry(self.fitframe,width=15)
         self.fitorder_entry.pack(side=tk.TOP) 
         self.fitorder_entry.bind('<Return>',self.fitorder_return) 
+        self.auto_button = tk.Button(self.fitframe,text=_("auto select"),command=self.auto_select,width=12,font=("Helvetica", 10))
+        self.auto_button.pack(side=tk.TOP,pady=(10,0))
+        self.auto_method = tk.StringVar()
+        self.auto_method.set('sigmaclip')
+        self.auto_menu = tk.OptionMenu(self.fitframe,self.auto_method,'sigmaclip','runmed')
+        self.auto_menu.configure(width=9)
+        self.auto_menu.pack(side=tk.TOP)
         
         self.winnavi_frame = tk.Frame(self.master,bg=bg)
         self.winnavi_frame.pack(side=tk.LEFT,padx=20)  
@@ -204,6 +283,10 @@ class Linemarker:
         self.savedefalt_appendstr = '_strict_winstr.txt' if switch_initial_on else '_loose_winstr.txt'
         self.savedefault_button = tk.Button(self.save_frame,text=_("save default"),command=self.savedefault,width=12,font=("Helvetica", 10))
         self.savedefault_button.pack(side=tk.TOP,pady=(10,0))
+        self.savesession_button = tk.Button(self.save_frame,text=_("save session"),command=self.save_sessionfile,width=12,font=("Helvetica", 10))
+        self.savesession_button.pack(side=tk.TOP,pady=(10,0))
+        self.opensession_button = tk.Button(self.save_frame,text=_("open session"),command=self.select_sessionfile,width=12,font=("Helvetica", 10))
+        self.opensession_button.pack(side=tk.TOP,pady=(10,0))
       
 
         
@@ -221,21 +304,48 @@ class Linemarker:
                 _varstrs = [varstrs]
             else:
                 _varstrs = varstrs
+            @functools.wraps(func)
             def wrapper(self,*arg,**kw):
                 for varstr in _varstrs:
                     if (not hasattr(self,varstr)) or (self.__dict__[varstr] is None) or (self.__dict__[varstr] is False):
                         if info:
                             print('variable %s doest not exists or is equal to None' %varstr)
                         return
-                return func(self,*arg,**kw)
+                with self.instrument.timed(func.__name__):
+                    return func(self,*arg,**kw)
+            wrapper._timed = True
             return wrapper
         return decorator
         
     def _updatecanvas(func):
+        # draw_idle coalesces a burst of events (e.g., wheel ticks) into one full draw
+        timed = getattr(func,'_timed',False)
+        @functools.wraps(func)
         def wrapper(self,*arg,**kw):
-            val = func(self,*arg,**kw)
-            self.canvas.draw()
+            if timed:
+                val = func(self,*arg,**kw)
+            else:
+                with self.instrument.timed(func.__name__):
+                    val = func(self,*arg,**kw)
+            self.canvas.draw_idle()
             return val
+        wrapper._timed = True
+        return wrapper
+
+    def _blitcanvas(func):
+        # for handlers changing only the spectrum, the mask shadow or the fit line, but not the axes
+        timed = getattr(func,'_timed',False)
+        @functools.wraps(func)
+        def wrapper(self,*arg,**kw):
+            if timed:
+                val = func(self,*arg,**kw)
+            else:
+                with self.instrument.timed(func.__name__):
+                    val = func(self,*arg,**kw)
+            with self.instrument.timed('blit',kind='draw'):
+                self.blitter.blit()
+            return val
+        wrapper._timed = True
         return wrapper
         
     def _check_winavi(func):
@@ -247,6 +357,18 @@ class Linemarker:
             return func(self,direction)
         return wrapper  
                 
+    def create_selector(self):
+        from matplotlib.widgets import RectangleSelector
+        #the rectangle is blitted by the Blitter with the other animated artists: with useblit=True,
+        #the selector would hide them and draw the whole canvas once more at each draw_event
+        self.selector = RectangleSelector(self.ax, self.draw_callback, useblit=False, 
+                               button=[1, 3], # disable middle button
+                               minspanx=5, minspany=5, spancoords='pixels', 
+                               interactive=False)                 
+        for artist in self.selector.artists:
+            self.blitter.add_artist(artist)
+        self.selector.update = self.blitter.blit
+        
     def set_scrolllimit(self,x1,x2):
         self.scrolllimit = (x1,x2)
         
@@ -259,11 +381,13 @@ class Linemarker:
             x1,x2 = x1*(scrolllimit[1]-scrolllimit[0]), x2*(scrolllimit[1]-scrolllimit[0])
             x1,x2 = x1+scrolllimit[0], x2+scrolllimit[0]
             self.ax.set_xlim(x1,x2)    
+            self.update_lod()
+            self.update_viewport()
        
     @_require('line_loaded')        
     def reset_scrollbar(self):
-        l = self.x.max()-self.x.min()
-        self.set_scrolllimit(self.x.min()-l/2.,  self.x.max()+l/2.)
+        l = self.axis.xmax-self.axis.xmin
+        self.set_scrolllimit(self.axis.xmin-l/2.,  self.axis.xmax+l/2.)
         scrolllimit=self.scrolllimit
         xlim = self.ax.get_xlim()
         x1 = (xlim[0]-scrolllimit[0])/(scrolllimit[1]-scrolllimit[0])
@@ -332,6 +456,7 @@ class Linemarker:
 
     def switch_changed(self,event):
         self.savedefalt_appendstr = '_strict_winstr.txt' if self.TS.is_on else '_loose_winstr.txt' 
+        self.update_watch()
         
     @_require(['line_loaded','mask','defaultdir','path_prefix'],info=False)
     def savedefault(self):
@@ -345,60 +470,360 @@ class Linemarker:
         if not overwrite:
             showinfo(_("info"),_("window ranges have been saved into '%s'") %filename)   
     
+    @_require('line_loaded',info=False)
+    def save_sessionfile(self):
+        filetypes = (   ('session','*.npz'),
+                        ('All files', '*'),
+                        )
+        filename = self.select_file(filetypes=filetypes,mode='save')
+        if filename == '':
+            return
+        states = {}
+        if self.session is not None:
+            states = {f:(st['mask'],st['mask_history'],st['mask_current']) for f,st in self.session.states.items()
+                      if f != self.session.current}
+        core.save_session(filename,self.x,self.y,specfile=self.filename,
+                          windows=getattr(self,'mask',None),
+                          history=self.mask_history,
+                          history_current=self.mask_current,
+                          fitorder=getattr(self,'fitorder',-1),
+                          fitspec=getattr(self,'fitspec',''),
+                          xlim=self.ax.get_xlim(),
+                          states=states,
+                          session_files=[] if self.session is None else self.session.filenames,
+                          session_index=-1 if self.session is None else self.session.index)
+        
+    def select_sessionfile(self):
+        filetypes = (   ('session','*.npz'),
+                        ('All files', '*'),
+                        )
+        filename = self.select_file(filetypes=filetypes)
+        if filename == '':
+            return
+        self.set_session_fromfile(filename)
+        
+    @_updatecanvas
+    def set_session_fromfile(self,filename):
+        # the spectrum is memory-mapped from the session file, see core.load_session
+        try:
+            d = core.load_session(filename)
+        except ValueError as e:
+            print(e)
+            showinfo(title='warning!',message=_("can not parse session file %s") %filename)
+            return
+        self.cancel_loading()
+        self.close_session()
+        if len(d['session_files']) > 0:
+            self.session = SpectrumSession(d['session_files'],self.read_spectrum)
+            self.session.index = self.session.target = d['session_index']
+            self.session.states = {f:dict(mask=w,mask_history=h,mask_current=c) for f,(w,h,c) in d['states'].items()}
+            self.session.get(self.session.index)
+        self.set_data(d['specfile'],d['x'],d['y'])
+        #the sessions written before the fitters have only the order
+        fitspec = (d['fitspec'] or str(d['fitorder'])) if d['fitorder'] >= 0 else ''
+        self.set_fitspec(fitspec)
+        self.fitorder_entry.delete(0,tk.END)
+        self.fitorder_entry.insert(0,fitspec)
+        self.set_state(d['windows'],d['history'],d['history_current'])
+        if d['xlim'] is not None:
+            self.ax.set_xlim(*d['xlim'])
+            self.reset_scrollbar()
+            self.update_lod()
+            self.update_viewport()
+        if self.session is not None:
+            self.update_session_label()
+        
     @_require(['line_loaded','mask'])            
     def _save(self,filename):
-        with open(filename,'w') as f:
-            print('prepare to write to %s' %filename)
-            s = self.parse_mask(self.mask,self.x)
-            f.write(s)
+        core.save_winstr(filename,self.mask,self.x,precision=self.precision)
         pdffilename = os.path.splitext(filename)[0]+'.pdf'
         self._savefig(pdffilename)
             
     @_require('fig')        
     def _savefig(self,pdffilename):
+        with self.blitter.static():
             self.fig.savefig(pdffilename)
         
     def select_datafile(self):
         filename = self.select_file()
         if filename == '':
             return
-        self.set_data_fromfile(filename)
-      
-    @_updatecanvas        
+        self.close_session()
+        self.load_datafile(filename)
+        
+    def select_cubefile(self):
+        filetypes = (   ('fits','*.fits'),
+                        ('All files', '*'),
+                        )
+        filename = self.select_file(filetypes=filetypes)
+        if filename == '':
+            return
+        region = askstring(_("cube region"),
+                           _("pixel box blcx,blcy,trcx,trcy or FITS mask file (empty for all pixels), then mean or max"),
+                           parent=self.master)
+        if region is None:
+            return
+        box,mask,stat = self.parse_region(region)
+        self.close_session()
+        self.load_cubefile(filename,box=box,mask=mask,stat=stat)
+        
+    @staticmethod
+    def parse_region(region):
+        # e.g. '100,100,120,120 max', 'mask.fits', or '' for the mean over all the pixels
+        words = region.split()
+        stat = 'mean'
+        if (len(words)>0) and (words[-1] in ('mean','max')):
+            stat = words.pop(-1)
+        region = ' '.join(words)
+        if os.path.isfile(region):
+            return None,region,stat
+        return region,None,stat
+        
+    def load_cubefile(self,filename,box=None,mask=None,stat='mean'):
+        def done(data):
+            #the cube itself is not reloaded, only its windows file
+            self.set_data(filename,*data,watch_spectrum=False)
+        self.start_loading(self.read_cube_spectrum,(filename,box,mask,stat),
+                           callback=done,
+                           message=_("can not extract a spectrum from cube %s") %filename)
+        
+    @staticmethod
+    def read_cube_spectrum(filename,box=None,mask=None,stat='mean',progress=None):
+        # runs in the worker thread: no Tk here
+        import Linemarker_cube
+        x,y = Linemarker_cube.cube_spectrum(filename,box=box,mask=mask,stat=stat,progress=progress)
+        return x,y,MinMaxPyramid(x,y)
+        
+    def select_directory(self):
+        dirname = fd.askdirectory(title=_("Open a directory"),initialdir=self.defaultdir)
+        if (type(dirname) != str) or (dirname == ''):
+            return
+        self.open_session([dirname])
+        
+    def open_session(self,paths,nprefetch=2):
+        filenames = core.find_spectra(paths)
+        if len(filenames) == 0:
+            showinfo(title='warning!',message=_("no spectrum file found in %s") %', '.join(paths))
+            return
+        self.close_session()
+        self.session = SpectrumSession(filenames,self.read_spectrum,nprefetch=nprefetch)
+        self.goto_spectrum(0)
+        
+    def close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+            self.session_label.config(text='')
+            
+    @_require('session',info=False)
+    def step_spectrum(self,step):
+        # from the spectrum being read, if any, so that quick presses are not lost
+        self.goto_spectrum(self.session.target+step)
+        
+    @_require('session',info=False)
+    def goto_spectrum(self,index):
+        if not (0 <= index < len(self.session)):
+            return
+        filename = self.session.filenames[index]
+        self.session.target = index
+        future = self.session.get(index)
+        callback = lambda data: self.show_session_spectrum(index,filename,data)
+        if future.done() and (not future.cancelled()) and (future.exception() is None):
+            self.loader.cancel()
+            self.stop_loading()
+            callback(future.result())
+        else:
+            self.start_loading(self.wait_future,(future,),callback=callback,
+                               message=_("can not parse data file %s") %filename)
+            
+    @staticmethod
+    def wait_future(future,progress=None):
+        # runs in the worker thread, waiting for the prefetch (which has no progress of its own)
+        while True:
+            try:
+                return future.result(timeout=0.05)
+            except concurrent.futures.TimeoutError:
+                if progress is not None:
+                    progress(0.)
+            
+    @_updatecanvas
+    def show_session_spectrum(self,index,filename,data):
+        self.store_state()
+        self.session.index = index
+        self.set_data(filename,*data)
+        state = self.session.states.get(filename)
+        if state is not None:
+            self.set_state(**state)
+        self.update_session_label()
+        
+    def update_session_label(self):
+        self.session_label.config(text='%i/%i' %(self.session.index+1,len(self.session)))
+        self.master.title('%s - %s' %(_("Line Marker"),os.path.basename(self.session.current)))
+        
+    def set_state(self,mask,mask_history,mask_current):
+        if not isinstance(mask_history,core.WindowsHistory):
+            n = len(mask_history)
+            mask_history = core.WindowsHistory(mask_history,budget=self.mask_history_budget)
+            #the oldest entries may have been dropped to fit in the budget
+            mask_current = max(mask_current-(n-len(mask_history)),-1)
+        self.mask_history = mask_history
+        self.mask_current = mask_current
+        if mask is not None:
+            self.mask = mask
+            self.update_shadow()
+            self.update_outputbox()
+            self.update_fitline()
+        
+    def store_state(self):
+        # the history is handed over to the session, and a new one is started
+        filename = self.session.current
+        if (filename is None) or (not self.line_loaded):
+            return
+        self.session.states[filename] = dict(mask=getattr(self,'mask',None),
+                                             mask_history=self.mask_history,
+                                             mask_current=self.mask_current)
+        self.reset_mask_history()
+        
+    def load_datafile(self,filename):
+        self.start_loading(self.read_spectrum,(filename,),
+                           callback=lambda data: self.set_data(filename,*data),
+                           message=_("can not parse data file %s") %filename)
+        
+    @staticmethod
+    def read_spectrum(filename,progress=None):
+        # runs in the worker thread: no Tk here
+        x,y = core.getdata_from_file(filename,progress=progress)
+        return x,y,MinMaxPyramid(x,y)
+        
+    def start_loading(self,func,args,callback,message):
+        def done(result):
+            self.stop_loading()
+            callback(result)
+        def failed(e):
+            self.stop_loading()
+            if not isinstance(e,ValueError):
+                print(e)
+            showinfo(title='warning!',message=message)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.loader.submit(func,args,callback=done,errback=failed,onprogress=self.show_progress)
+        
+    def show_progress(self,fraction):
+        self.progress_value.set(100.*fraction)
+        
+    def stop_loading(self):
+        self.progress_value.set(0)
+        self.cancel_button.config(state=tk.DISABLED)
+        
+    def cancel_loading(self):
+        self.loader.cancel()
+        self.stop_loading()
+        
     def set_data_fromfile(self,filename):        
         data = self.getdata_from_file(filename)
-        #print(filename,data)
         if data is not None:
-            self.x=data[0]
-            self.y=data[1]
-            self.line_loaded = True
-            self.line=self.update_line(self.x,self.y,self.line,color='C0')
-            self.reset_limit()
-            if hasattr(self,'mask'):
-                del self.mask
-            self.update_shadow() 
-            self.reset_mask_history()
-            self.remove_fitline()
-            self.update_outputbox()    
-            
-            self.defaultdir = os.path.dirname(filename) 
-            basename = os.path.basename(filename)
-            self.path_prefix,self.path_ext = os.path.splitext(basename)            
-            
+            self.set_data(filename,*data)
+      
+    @_updatecanvas        
+    def set_data(self,filename,x,y,pyramid=None,watch_spectrum=True):
+        self.x=x
+        self.y=y
+        self.line_loaded = True
+        #the extrema and the channel lookups, computed once per spectrum
+        self.axis = core.SpectralAxis(self.x,self.y)
+        self.pyramid = MinMaxPyramid(self.x,self.y) if pyramid is None else pyramid
+        xy = self.pyramid.query(self.axis.xmin,self.axis.xmax,self.get_npix())
+        self.blitter.remove_artist(self.line)
+        self.line=self.update_line(*xy,self.line,color='C0')
+        self.blitter.add_artist(self.line)
+        self.fitter = core.make_fitter(self.fitkind,self.x,self.y,nseg=self.fitnseg)
+        self.update_overview()
+        self.reset_limit()
+        if hasattr(self,'mask'):
+            del self.mask
+        self.update_shadow() 
+        self.reset_mask_history()
+        self.remove_fitline()
+        self.update_outputbox()    
+        
+        self.filename = filename
+        self.defaultdir = os.path.dirname(filename) 
+        basename = os.path.basename(filename)
+        self.path_prefix,self.path_ext = os.path.splitext(basename)            
+        self.watch_spectrum = watch_spectrum
+        self.update_watch()
+        
+    @_require(['watcher','filename'],info=False)
+    def update_watch(self):
+        """
+        Watch the spectrum file (unless it is a cube, see watch_spectrum), and its windows file:
+        the one opened for this spectrum, or else the one written by "save default".
+        """
+        self.watcher.clear()
+        if self.watch_spectrum:
+            self.watcher.watch(self.filename,self.reload_datafile)
+        winfile = self.winfiles.get(self.filename)
+        if winfile is None:
+            winfile = os.path.join(self.defaultdir,self.path_prefix+self.savedefalt_appendstr)
+        self.watcher.watch(winfile,self.reload_winfile)
+        
+    def reload_datafile(self,filename):
+        # called by the watcher: the spectrum is read again in the background, see reset_data
+        if self.loader.busy:
+            return False  # asked again at the next poll
+        if self.session is not None:
+            self.session.futures.pop(filename,None)
+        self.start_loading(self.read_spectrum,(filename,),
+                           callback=lambda data: self.reset_data(filename,*data),
+                           message=_("can not parse data file %s") %filename)
+        
+    @_updatecanvas
+    def reset_data(self,filename,x,y,pyramid=None):
+        """
+        Replace the spectrum by a new version of the same file, keeping the windows, their history and the view.
+        If the channels changed (their number or their frequencies), the windows are kept in frequency,
+        and their history is restarted.
+        """
+        if filename != self.filename:
+            # another spectrum was loaded meanwhile
+            return
+        mask = getattr(self,'mask',None)
+        history,current = self.mask_history,self.mask_current
+        xlim = self.ax.get_xlim()
+        if not np.array_equal(x,self.x):
+            if mask is not None:
+                mask = core.parse_winstr_windows(core.format_windows(mask,self.x,precision=-1),x)
+            history,current = ([],-1) if mask is None else ([mask],0)
+        self.set_data(filename,x,y,pyramid)
+        self.set_state(mask,history,current)
+        self.ax.set_xlim(*xlim)
+        self.reset_scrollbar()
+        self.update_lod()
+        self.update_viewport()
+        
+    def reload_winfile(self,filename):
+        """
+        Called by the watcher when the windows file is rewritten: the new windows go into the history
+        like a drag (see set_mask), with a blit, and nothing is done if they did not change
+        (e.g., the file was written by "save default").
+        """
+        if not self.line_loaded:
+            return
+        try:
+            mask = self.read_windows(filename,self.x)
+        except (OSError,ValueError) as e:
+            print('can not parse win file %s: %s' %(filename,e))
+            return
+        if hasattr(self,'mask') and np.array_equal(mask,self.mask):
+            return
+        self.set_mask(mask,self.x)
+        
     def getdata_from_file(self,filename):
-        _, ext = os.path.splitext(filename)
-        if ext == '.tsv':
-            T=t.Table.read(filename,format='ascii.no_header',names=['x','y'])
-            x = np.array(T['x'])*1E3
-            y = np.array(T['y'])
-            if x[1]<x[0]:
-                x = x[::-1]
-                y = y[::-1]
-            return x,y
-        showinfo(title='warning!',message=_("can not parse data file %s") %filename)   
-        return None
+        try:
+            return core.getdata_from_file(filename)
+        except ValueError:
+            showinfo(title='warning!',message=_("can not parse data file %s") %filename)   
+            return None
      
-    @_updatecanvas    
     def select_winfile(self):
         filetypes = (   ('text files', '*.txt'),
                         ('tsv','*.tsv'),
@@ -409,16 +834,32 @@ class Linemarker:
         filename = self.select_file(filetypes=filetypes)
         if filename == '':
             return
-        try:
-            with open(filename) as f:
-                self.mask=self.parse_winstr(f.read(),self.x)
-            self.update_shadow() 
-            self.append_mask_history(self.mask)
-            self.update_outputbox()
-            self.update_fitline()            
-        except Exception as e:
-            showinfo(title='warning!',message=_("can not parse win file %s") %filename)
-            raise e        
+        x = getattr(self,'x',None)
+        if self.line_loaded:
+            self.winfiles[self.filename] = filename
+            self.update_watch()
+        self.start_loading(self.read_windows,(filename,x),
+                           callback=lambda mask: self.set_mask(mask,x),
+                           message=_("can not parse win file %s") %filename)
+        
+    @staticmethod
+    def read_windows(filename,x,progress=None):
+        # runs in the worker thread: no Tk here
+        winstr = core.read_winstr(filename)
+        if progress is not None:
+            progress(0.5)
+        return core.parse_winstr_windows(winstr,x)
+        
+    @_blitcanvas
+    def set_mask(self,mask,x):
+        if x is not self.x:
+            # another spectrum was loaded meanwhile
+            return
+        self.mask = mask
+        self.update_shadow() 
+        self.append_mask_history(self.mask)
+        self.update_outputbox()
+        self.update_fitline()            
                 
     def update_line(self,x,y,line=None,**kw):
         if line in self.ax.lines:
@@ -432,10 +873,12 @@ class Linemarker:
     def reset_limit(self):
         #if not self.line_loaded:
         #    return
-        self.ax.set_xlim(self.x.min(),self.x.max())
-        dy = (self.y.max()-self.y.min())*0.02
-        self.ax.set_ylim(self.y.min()-dy,self.y.max()+dy)
+        self.ax.set_xlim(self.axis.xmin,self.axis.xmax)
+        dy = (self.axis.ymax-self.axis.ymin)*0.02
+        self.ax.set_ylim(self.axis.ymin-dy,self.axis.ymax+dy)
         self.reset_scrollbar()
+        self.update_lod()
+        self.update_viewport()
  
     @_updatecanvas
     def reset_limit_listen(self,event):
@@ -454,52 +897,85 @@ class Linemarker:
             )
             self.ax.set_xlim(new_xlim)
             self.reset_scrollbar()
+            self.update_lod()
+            self.update_viewport()
+
+    @_updatecanvas
+    @_require('line_loaded',info=False)
+    def overview_callback(self,x1,x2):
+        self.ax.set_xlim(x1,x2)
+        self.reset_scrollbar()
+        self.update_lod()
+        
+    @_require(['overview','line_loaded'],info=False)
+    def update_viewport(self):
+        self.overview.set_view(*self.ax.get_xlim())
+        
+    @_require(['overview','line_loaded'],info=False)
+    def update_overview(self):
+        # drawn once per spectrum, decimated to the width of the strip
+        self.overview.set_data(*self.pyramid.query(self.axis.xmin,self.axis.xmax,self.overview.get_npix()))
+        
+    def resize_listen(self,event):
+        self.update_lod()
 
+    def get_npix(self):
+        return self.ax.get_window_extent().width
+
+    @_require(['line_loaded','pyramid'],info=False)
+    def update_lod(self):
+        """
+        Only the min/max decimated spectrum of the visible range is drawn, at about one block of channels per pixel.
+        """
+        x1,x2 = self.ax.get_xlim()
+        npix = self.get_npix()
+        self.line.set_data(*self.pyramid.query(x1,x2,npix))
+        if hasattr(self,'fitline'):
+            xs = self.line.get_xdata()
+            self.fitline.set_data(xs,self.fitter.evaluate(self.fitcoef,xs))
+
+    @_require('line_loaded',info=False)
     def update_shadow(self,alpha=0.4,color='gray'):
+        windows = self.mask if hasattr(self,'mask') else core.empty_windows()
+        verts = core.window_spans(windows,self.x)
         if hasattr(self,'mask_shadow') and (self.mask_shadow in self.ax.collections):
-            try:
-                self.ax.collections.remove(self.mask_shadow)
-            except Exception:
-                self.mask_shadow.remove()
-        yl,yu=self.ax.get_ylim()
-        if hasattr(self,'mask') and self.line_loaded:
-            self.mask_shadow = self.ax.fill_between(self.x,yl,yl+(yu-yl),self.mask,color=color,alpha=alpha)
+            self.mask_shadow.set_verts(verts)
+        else:
+            self.mask_shadow = core.add_window_spans(self.ax,windows,self.x,alpha=alpha,color=color)
+            self.blitter.add_artist(self.mask_shadow)
+        if hasattr(self,'overview'):
+            self.overview.set_spans(verts)
        
-    @_updatecanvas  
+    @_blitcanvas  
     @_require('line_loaded')  
     def draw_callback(self,eclick, erelease):
         x1,x2= eclick.xdata, erelease.xdata
         x1,x2 = (x1,x2) if x2>x1 else (x2,x1) 
         if not hasattr(self,'mask'):
-            self.mask = np.zeros_like(self.x, dtype='bool')
+            self.mask = core.empty_windows()
         if eclick.button == 1:
-            self.mask = self.mask | ((self.x>x1)&(self.x<x2))
+            first,last = self.axis.channel_range(x1,x2)
+            self.mask = core.windows_union(self.mask,first,last)
         if eclick.button == 3:
-            self.mask = self.mask & ((self.x<x1)|(self.x>x2))
+            first,last = self.axis.channel_range(x1,x2,inclusive=True)
+            self.mask = core.windows_subtract(self.mask,first,last)
         self.update_shadow()  
         self.append_mask_history(self.mask)     
         self.update_outputbox()  
         self.update_fitline()
         
     def append_mask_history(self,mask):
-        self.mask_history.insert(self.mask_current+1,mask)
-        self.mask_current = self.mask_current+1
-        if len(self.mask_history) > (self.mask_current+1):
-            for i in range( len(self.mask_history) - (self.mask_current+1) ):
-                 self.mask_history.pop(-1)
-        if len(self.mask_history)>self.mask_maxhistory:
-            self.mask_history.pop(0)
-            self.mask_current = len(self.mask_history)-1     
+        # the redo entries are dropped, and the oldest ones once over mask_history_budget
+        self.mask_history.truncate(self.mask_current+1)
+        self.mask_history.append(mask)
+        self.mask_current = len(self.mask_history)-1     
             
     def reset_mask_history(self):
-        if not hasattr(self,'mask_history'):
-            self.mask_history = []
-        for i in range(len(self.mask_history)):
-            self.mask_history.pop(-1)
+        self.mask_history = core.WindowsHistory(budget=self.mask_history_budget)
         self.mask_current = -1 
      
     @_check_winavi
-    @_updatecanvas 
+    @_blitcanvas 
     @_require('mask',info=False)   
     def winnavi_callback(self,direction):  
         if direction == 'delete all':
@@ -534,84 +1010,108 @@ class Linemarker:
         event.widget.event_generate('<<SelectAll>>') 
         #self.output_box.configure(state='disabled')  
         
+    @_blitcanvas
+    @_require('line_loaded')
+    def auto_select(self):
+        """
+        Propose the line-free windows for the strict or loose case chosen by the toggle switch.
+        The result goes into the history like a drag, so it can be refined or undone.
+        """
+        case = 'strict' if self.TS.is_on else 'loose'
+        fitorder = self.fitorder if getattr(self,'fitorder',-1)>=0 else 1
+        self.mask = core.auto_windows(self.x,self.y,case=case,method=self.auto_method.get(),fitorder=fitorder)
+        self.update_shadow()
+        self.append_mask_history(self.mask)
+        self.update_outputbox()
+        self.update_fitline()
+
+    @_blitcanvas
     def fitorder_return(self,event):
-        order = event.widget.get()
-        #print('order:',order)
-        if order.isnumeric():
-            self.fitorder = int(order)
-        elif (order == '') or (order[0]=='-'):
-            self.fitorder = -1
-        else:
+        try:
+            self.set_fitspec(event.widget.get())
+        except ValueError as e:
+            print(e)
             return
         self.update_fitline()    
+
+    def set_fitspec(self,spec):
+        """
+        Select the baseline from the text of the fit order entry, see core.parse_fitspec.
+        A new fitter is made only when the kind or the segments change, so that an order change
+        of the polynomial fits keeps the sums accumulated by IncrementalFit.
+        """
+        fit = core.parse_fitspec(spec)
+        if fit is None:
+            self.fitorder = -1
+            self.fitspec = ''
+            return
+        kind,self.fitorder,nseg = fit
+        self.fitspec = spec.strip().lower()
+        if (kind,nseg) != (self.fitkind,self.fitnseg):
+            self.fitkind,self.fitnseg = kind,nseg
+            if hasattr(self,'x'):
+                self.fitter = core.make_fitter(self.fitkind,self.x,self.y,nseg=self.fitnseg)
             
 
-    @_updatecanvas
     @_require(['line_loaded','mask','fitorder'],info=False)            
     def update_fitline(self):
+        # not blitted here: the callers (draw_callback, set_mask, ...) blit once after all their changes
         self.remove_fitline()
-        if self.fitorder<0:
-            return     
-        if self.mask.sum()<=self.fitorder:
-                    print('the channel number is not enough for %i-order poly fitting' %(self.fitorder) )
-                    return
-        xfit = (self.x-self.x.min())/(self.x.max()-self.x.min())
-        ppar = np.polyfit(xfit[self.mask],self.y[self.mask],self.fitorder)
-        yfit = np.polyval(ppar,xfit)
-        self.fitline = self.ax.plot(self.x,yfit,
+        #only the channels added to or removed from the windows since the last fit are accumulated
+        self.fitter.set_windows(self.mask)
+        self.fitcoef = self.fitter.solve(self.fitorder)
+        if self.fitcoef is None:
+            return
+        #the baseline is smooth, so it is evaluated only at the channels drawn for the spectrum
+        xs = self.line.get_xdata()
+        self.fitline = self.ax.plot(xs,self.fitter.evaluate(self.fitcoef,xs),
                                    color='r',alpha=0.3,ls='--')[0] 
+        self.blitter.add_artist(self.fitline)
                
         
             
     @_require('fitline',info=False)
     def remove_fitline(self):
+        self.blitter.remove_artist(self.fitline)
         self.fitline.remove()
         del self.fitline       
         
     @classmethod
     def parse_winstr(cls,winstr,x):
-        win = np.zeros_like(x,dtype='bool')
-        wins = [i.split('~') for i in winstr.strip().split(';')]
-        wins = [(float(i[0]),float(i[1])) for i in wins] 
-        for i in wins:
-            leftdex = np.argmin(np.abs( i[0]-x )) 
-            rightdex = np.argmin(np.abs( i[1]-x ))
-            win[leftdex:rightdex+1] = True
-            #Be carefull that 'win[(x>=i[0]) & (x<=i[1])]=True' performs not good,
-            #since the frequency written to file has been truncated with limited precision.
-        return win
+        return core.parse_winstr(winstr,x)
  
     @classmethod        
     def parse_mask_edges(cls,mask):
-        mask1 = np.zeros(len(mask)+2,dtype='bool')
-        mask1[0]  = False
-        mask1[-1] = False
-        mask1[1:-1] = mask
-        left_edges  = (~mask1[0:-2]) & (mask1[1:-1])
-        right_edges = (mask1[1:-1]) & (~mask1[2:])
-        left_edges = np.arange(len(mask))[left_edges] 
-        right_edges = np.arange(len(mask))[right_edges]
-        assert len(left_edges) == len(right_edges)
-        return np.array([left_edges,right_edges]).T
+        return core.parse_mask_edges(mask)
     
     @classmethod
     def parse_mask(cls,mask,x):
-        edges=cls.parse_mask_edges(mask)
-        return ';'.join(['%.4f~%.4f' %(x[dex[0]],x[dex[1]]) for dex in edges])        
+        return core.parse_mask(mask,x)        
         
     @_require('output_box')    
     def update_outputbox(self):
-        #self.output_box.configure(state='normal')
-        self.output_box.delete('1.0', tk.END)
-        if hasattr(self,'mask'):
-            s = self.parse_mask(self.mask,self.x)
-            self.output_box.insert('1.0', s)            
-        #self.output_box.configure(state='disabled')
+        #only the changed windows are replaced, since the Text widget is slow with a long line
+        new = core.format_windows(self.mask,self.x,precision=self.precision) if hasattr(self,'mask') else ''
+        old = self.output_box.get('1.0','end-1c')
+        start,stop_old,stop_new = core.changed_span(old,new)
+        if stop_old > start:
+            self.output_box.delete('1.0+%ic' %start,'1.0+%ic' %stop_old)
+        if stop_new > start:
+            self.output_box.insert('1.0+%ic' %start,new[start:stop_new])
             
     def on_closing(self):
+        self.loader.cancel()
+        if self.watcher is not None:
+            self.watcher.clear()
+        self.close_session()
         self.master.quit()
         self.master.destroy() 
         
+    def update_status(self,interval=500):
+        # polled rather than updated by each handler, to keep the status line out of the timings
+        self.status_label.config(text=self.instrument.status_line())
+        self.master.after(interval,self.update_status)
+        
     @_updatecanvas    
     def configure_labels(self,lang):
         lang_translators[lang].install()
@@ -628,6 +1128,12 @@ class Linemarker:
         self.winnavi_del.config(text=_("delete all"))
         self.save_button.config(text=_("save as"))
         self.savedefault_button.config(text=_("save default"))
+        self.auto_button.config(text=_("auto select"))
+        self.cancel_button.config(text=_("cancel"))
+        self.opendir_button.config(text=_("Open a directory"))
+        self.opencube_button.config(text=_("Open a cube"))
+        self.savesession_button.config(text=_("save session"))
+        self.opensession_button.config(text=_("open session"))
         
         font = ('fangsong ti',10)
         self.labelDir1.config(font=font)
@@ -640,6 +1146,11 @@ class Linemarker:
         self.winnavi_del.config(font=font)
         self.save_button.config(font=font)
         self.savedefault_button.config(font=font)
+        self.auto_button.config(font=font)
+        self.opendir_button.config(font=font)
+        self.opencube_button.config(font=font)
+        self.savesession_button.config(font=font)
+        self.opensession_button.config(font=font)
      
     @_require('supporting_language_switch')    
     def switch_language(self,*arg):
@@ -649,10 +1160,39 @@ class Linemarker:
         self.configure_labels(lang)
         
         
+def get_parser():
+    parser = argparse.ArgumentParser(description='GUI to select the line-free channels of a spectrum.')
+    parser.add_argument('spectra',nargs='*',help='spectrum files, or directories of spectrum files, reviewed one after another (PageUp/PageDown)')
+    parser.add_argument('-p','--precision',type=int,default=core.winstr_precision,help='decimals of the frequencies (MHz) written in the windows, negative for the full precision (default: %(default)s)')
+    parser.add_argument('--watch',type=float,nargs='?',const=1.,default=None,metavar='SECONDS',
+                        help='poll the spectrum file and its windows file every SECONDS (default: 1), and reload them when they are rewritten, e.g. by a pipeline')
+    parser.add_argument('--profile',action='store_true',default=os.environ.get('LINEMARKER_PROFILE','0') not in ('','0'),
+                        help='time the handlers and the draws, show the rolling timings in a status line, and write PREFIX.json (chrome://tracing format) on exit; also set by LINEMARKER_PROFILE=1')
+    parser.add_argument('--cprofile',action='store_true',help='run the session under cProfile and write PREFIX.prof on exit')
+    parser.add_argument('--profile-prefix',default='linemarker_profile',help='prefix of the profiling outputs (default: %(default)s)')
+    return parser
+        
+        
 if __name__ == "__main__":
+    args = get_parser().parse_args()
+    instrument = Instrument(enabled=args.profile)
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     tkroot = tk.Tk()
     print(_("Line Marker"))
     tkroot.title(_("Line Marker"))
-    app = Linemarker(tkroot,bg='#ECECEC')
+    app = Linemarker(tkroot,bg='#ECECEC',instrument=instrument,precision=args.precision,watch=args.watch)
     tkroot.protocol('WM_DELETE_WINDOW',app.on_closing )
+    if len(args.spectra) > 0:
+        tkroot.after_idle(app.open_session,args.spectra)
     tkroot.mainloop()
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.profile_prefix+'.prof')
+        print('cProfile stats written to %s.prof' %args.profile_prefix)
+    if instrument.enabled:
+        print(instrument.summary())
+        instrument.dump_json(args.profile_prefix+'.json')
+        print('timings written to %s.json' %args.profile_prefix)
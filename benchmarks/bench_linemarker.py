@@ -0,0 +1,228 @@
+#!python
+#########################################
+#Benchmarks of the hot paths of the linemarker on synthetic spectra.
+#The results are written as json, so that two versions can be compared:
+#   $ python benchmarks/bench_linemarker.py --out new.json
+#   $ python benchmarks/bench_linemarker.py --out new.json --compare old.json
+#   $ python benchmarks/bench_linemarker.py --sizes 4000 100000 1000000 10000000 --nwin 500
+#The outputs in testdata/ are checked first, as correctness oracles.
+#########################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,rootdir)
+import Linemarker_core as core
+from util.pyramid import MinMaxPyramid
+
+testdatadir = os.path.join(rootdir,'testdata')
+
+
+def check_oracles():
+    """
+    The windows files in testdata/ were written by the GUI: reading them back and writing them again
+    through the mask must give the same strings.
+    """
+    specfile = os.path.join(testdatadir,'spw0spe_test1.tsv')
+    x,y = core.getdata_from_file(specfile,cache=False)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for case in ('strict','loose'):
+            winstr = core.read_winstr(os.path.join(testdatadir,'spw0spe_test1_%s_winstr.txt' %case))
+            mask = core.parse_winstr(winstr,x)
+            assert core.parse_mask(mask,x) == winstr, 'parse_winstr/parse_mask round trip of the %s case' %case
+            assert (core.parse_mask_edges(mask) == core.parse_winstr_windows(winstr,x)).all()
+            outfile = os.path.join(tmpdir,'out_winstr.txt')
+            core.process_spectrum(specfile,winstr,outfile=outfile,savepdf=False)
+            assert core.read_winstr(outfile) == winstr, 'process_spectrum of the %s case' %case
+    finally:
+        shutil.rmtree(tmpdir)
+    print('oracles in testdata/ passed')
+
+
+def synthetic_spectrum(nchan,nwin,seed=0):
+    """
+    A spectrum with a curved baseline, noise and lines, in MHz as returned by getdata_from_file,
+    and nwin windows of random widths between the lines.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(216969.,218842.,nchan)
+    u = np.linspace(-1,1,nchan)
+    y = 0.1+0.02*u-0.03*u**2+rng.normal(0,0.005,nchan)
+    for cen in rng.integers(0,nchan,max(nwin//2,1)):
+        width = max(nchan//20000,2)
+        i0,i1 = max(cen-5*width,0),min(cen+5*width,nchan)
+        y[i0:i1] += 0.3*np.exp(-0.5*((np.arange(i0,i1)-cen)/width)**2)
+    edges = np.sort(rng.choice(nchan,2*nwin,replace=False)).reshape(-1,2)
+    windows = core.normalise_windows(edges)
+    return x,y,windows
+
+
+def write_tsv(filename,x,y):
+    with open(filename,'w') as f:
+        f.write('# Z-profile synthetic\n# xLabel: [LSRK] Frequency (GHz)\n# yLabel: Value (Jy/beam)\n# x\ty\n')
+        np.savetxt(f,np.c_[x*1E-3,y],fmt=['%.11f','%.10e'],delimiter='\t')
+
+
+def timeit(func,repeat=5,number=1):
+    """
+    Return the best and the median time (s) of one call of func.
+    """
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        for j in range(number):
+            func()
+        times.append((time.perf_counter()-t0)/number)
+    return min(times), float(np.median(times))
+
+
+def new_axes():
+    fig = core.new_figure()
+    return fig, fig.axes[0]
+
+
+def bench_size(nchan,nwin,repeat,maxfile,maxfulldraw,tmpdir):
+    x,y,windows = synthetic_spectrum(nchan,nwin)
+    mask = core.windows_to_mask(windows,nchan)
+    winstr = core.format_windows(windows,x)
+    cases = {}
+
+    if nchan <= maxfile:
+        specfile = os.path.join(tmpdir,'spec%i.tsv' %nchan)
+        write_tsv(specfile,x,y)
+        def cold():
+            if os.path.exists(specfile+core.cache_ext):
+                os.remove(specfile+core.cache_ext)
+            core.getdata_from_file(specfile)
+        cases['getdata_from_file (no cache)'] = lambda: core.getdata_from_file(specfile,cache=False)
+        cases['getdata_from_file (write cache)'] = cold
+        core.getdata_from_file(specfile)
+        cases['getdata_from_file (cached)'] = lambda: core.getdata_from_file(specfile)
+
+    cases['parse_winstr'] = lambda: core.parse_winstr(winstr,x)
+    cases['parse_winstr_windows'] = lambda: core.parse_winstr_windows(winstr,x)
+    cases['parse_mask_edges'] = lambda: core.parse_mask_edges(mask)
+    cases['parse_mask'] = lambda: core.parse_mask(mask,x)
+    cases['format_windows'] = lambda: core.format_windows(windows,x)
+    cases['windows_union'] = lambda: core.windows_union(windows,nchan//3,nchan//3+nchan//100)
+    cases['update_fitline polyfit (order 3)'] = lambda: core.fit_baseline(x,y,mask,3)
+
+    fitter = core.IncrementalFit(x,y)
+    cases['IncrementalFit from scratch'] = lambda: (fitter.reset(fitter.xmin,fitter.xmax), fitter.set_windows(windows))
+    edited = core.windows_union(windows,nchan//3,nchan//3+nchan//1000)
+    state = {'flip':False}
+    def incremental():
+        state['flip'] = not state['flip']
+        fitter.set_windows(edited if state['flip'] else windows)
+        fitter.solve(3)
+    cases['IncrementalFit window edit + solve'] = incremental
+    for spec in ('robust3','piece3/8','spline20'):
+        kind,order,nseg = core.parse_fitspec(spec)
+        other = core.make_fitter(kind,x,y,nseg=nseg)
+        other.set_windows(windows)
+        cases['%s solve' %spec] = lambda other=other,order=order: other.solve(order)
+
+    fig,ax = new_axes()
+    spans = core.add_window_spans(ax,windows,x)
+    cases['update_shadow (spans)'] = lambda: spans.set_verts(core.window_spans(windows,x))
+    if nchan <= maxfulldraw:
+        def fill_between():
+            fb = ax.fill_between(x,0,1,mask,transform=ax.get_xaxis_transform())
+            fb.remove()
+        cases['update_shadow (fill_between)'] = fill_between
+
+    cases['MinMaxPyramid build'] = lambda: MinMaxPyramid(x,y)
+    pyramid = MinMaxPyramid(x,y)
+    npix = ax.get_window_extent().width
+    cases['MinMaxPyramid query (full range)'] = lambda: pyramid.query(x[0],x[-1],npix)
+
+    fig,ax = new_axes()
+    line = ax.plot(*pyramid.query(x[0],x[-1],npix),color='C0')[0]
+    core.add_window_spans(ax,windows,x)
+    yfit = core.fit_baseline(x,y,mask,3)
+    ax.plot(line.get_xdata(),np.interp(line.get_xdata(),x,yfit),color='r',alpha=0.3,ls='--')
+    ax.set_xlim(x[0],x[-1])
+    cases['Agg redraw (decimated)'] = fig.canvas.draw
+    if nchan <= maxfulldraw:
+        fig,ax = new_axes()
+        core.plot_spectrum(ax,x,y,windows=windows,yfit=yfit)
+        cases['Agg redraw (full resolution)'] = fig.canvas.draw
+
+    results = []
+    for name,func in cases.items():
+        func()  # warm up
+        best,median = timeit(func,repeat=repeat)
+        results.append(dict(name=name,nchan=nchan,nwin=len(windows),best=best,median=median,repeat=repeat))
+        print('%-40s nchan=%-9i best %10.3f ms   median %10.3f ms' %(name,nchan,best*1E3,median*1E3))
+    return results
+
+
+def get_version():
+    try:
+        return subprocess.check_output(['git','describe','--always','--dirty'],cwd=rootdir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(results,reffile):
+    with open(reffile) as f:
+        ref = json.load(f)
+    refdict = {(r['name'],r['nchan']):r for r in ref['results']}
+    print('\ncompared with %s (version %s): ratio of the best times, >1 means slower now' %(reffile,ref.get('version')))
+    for r in results:
+        key = (r['name'],r['nchan'])
+        if key in refdict:
+            print('%-40s nchan=%-9i %8.2f' %(r['name'],r['nchan'],r['best']/refdict[key]['best']))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the parsing, masking, fitting and rendering of the linemarker.')
+    parser.add_argument('--sizes',type=int,nargs='+',default=[4000,100000,1000000,10000000],help='numbers of channels (default: %(default)s)')
+    parser.add_argument('--nwin',type=int,default=300,help='number of windows (default: %(default)s)')
+    parser.add_argument('--repeat',type=int,default=5,help='repeats of each timing (default: %(default)s)')
+    parser.add_argument('--maxfile',type=int,default=1000000,help='largest spectrum written to a tsv file for the reading benchmarks (default: %(default)s)')
+    parser.add_argument('--maxfulldraw',type=int,default=1000000,help='largest spectrum drawn at full resolution (default: %(default)s)')
+    parser.add_argument('--out',default='bench_results.json',help='the json output (default: %(default)s)')
+    parser.add_argument('--compare',default=None,help='a json output of another version to compare with')
+    parser.add_argument('--nocheck',action='store_true',help='skip the correctness checks')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if not args.nocheck:
+        check_oracles()
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for nchan in args.sizes:
+            results.extend(bench_size(nchan,args.nwin,args.repeat,args.maxfile,args.maxfulldraw,tmpdir))
+    finally:
+        shutil.rmtree(tmpdir)
+    output = dict(version=get_version(),
+                  time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  python=platform.python_version(),
+                  numpy=np.__version__,
+                  machine=platform.platform(),
+                  results=results)
+    with open(args.out,'w') as f:
+        json.dump(output,f,indent=1)
+    print('results written to %s' %args.out)
+    if args.compare is not None:
+        compare(results,args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!python
+#########################################
+#Cold start time of the linemarker GUI, measured in fresh interpreters, e.g. in CI:
+#   $ python benchmarks/bench_startup.py --max-import 1.5
+#   $ python benchmarks/bench_startup.py --window --out startup.json     # needs a display
+#The exit code is 1 if a heavy module (astropy, ipywidgets, pyplot) is imported at startup,
+#or if the median time exceeds the given limits.
+#########################################
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#modules which must only be loaded on first use, if at all
+lazy_modules = ['astropy','ipywidgets','IPython','matplotlib.pyplot']
+
+import_code = """
+import sys, time, json
+t0 = time.perf_counter()
+import Linemarker_tk_v1
+t1 = time.perf_counter()
+print(json.dumps(dict(import_time=t1-t0, modules=sorted(sys.modules))))
+"""
+
+window_code = """
+import sys, time, json
+t0 = time.perf_counter()
+import tkinter as tk
+import Linemarker_tk_v1
+t1 = time.perf_counter()
+tkroot = tk.Tk()
+app = Linemarker_tk_v1.Linemarker(tkroot)
+tkroot.update()
+t2 = time.perf_counter()
+tkroot.destroy()
+print(json.dumps(dict(import_time=t1-t0, window_time=t2-t0, modules=sorted(sys.modules))))
+"""
+
+
+def run(code):
+    """
+    Run code in a fresh interpreter started in the root of the repository, and return the json it prints.
+    """
+    out = subprocess.check_output([sys.executable,'-c',code],cwd=rootdir)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def loaded_lazy_modules(modules):
+    return [m for m in lazy_modules if m in modules]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Measure the cold start of the linemarker GUI.')
+    parser.add_argument('--repeat',type=int,default=5,help='number of fresh interpreters (default: %(default)s)')
+    parser.add_argument('--window',action='store_true',help='also measure the time until the first window is drawn (needs a display)')
+    parser.add_argument('--max-import',type=float,default=None,help='fail if the median import time (s) is larger')
+    parser.add_argument('--max-window',type=float,default=None,help='fail if the median time (s) to the first window is larger')
+    parser.add_argument('--out',default=None,help='write the results in this json file')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    code = window_code if args.window else import_code
+    runs = [run(code) for i in range(args.repeat)]
+    results = dict(import_time=float(np.median([r['import_time'] for r in runs])))
+    print('import Linemarker_tk_v1: median %.3f s, best %.3f s' %(results['import_time'],min(r['import_time'] for r in runs)))
+    if args.window:
+        results['window_time'] = float(np.median([r['window_time'] for r in runs]))
+        print('first window drawn:      median %.3f s, best %.3f s' %(results['window_time'],min(r['window_time'] for r in runs)))
+    results['lazy_modules_loaded'] = loaded_lazy_modules(runs[0]['modules'])
+    if args.out is not None:
+        with open(args.out,'w') as f:
+            json.dump(results,f,indent=1)
+
+    failed = False
+    if results['lazy_modules_loaded']:
+        print('imported at startup, should be lazy: %s' %', '.join(results['lazy_modules_loaded']))
+        failed = True
+    if (args.max_import is not None) and (results['import_time'] > args.max_import):
+        print('import time above the limit of %.3f s' %args.max_import)
+        failed = True
+    if (args.max_window is not None) and (results.get('window_time',0) > args.max_window):
+        print('time to the first window above the limit of %.3f s' %args.max_window)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from distutils.core import setup
 setup(name='Linemarker',
       version='tk_1.0',
-      py_modules=['Linemarker_tk_v1'],
+      py_modules=['Linemarker_tk_v1','Linemarker_core','Linemarker_batch','Linemarker_cube','Linemarker_export'],
       )
@@ -0,0 +1,28 @@
+import numpy as np
+
+import Linemarker_core as core
+
+
+def test_noiseless():
+    # without noise every channel is line-free, rather than none
+    nchan = 5000
+    x = np.linspace(2.2E5, 2.21E5, nchan)
+    for y in (np.zeros(nchan), np.full(nchan, 3.7E-3), 1E4+np.linspace(-2., 5., nchan)):
+        for method in ('sigmaclip', 'runmed'):
+            for case in ('strict', 'loose'):
+                windows = core.auto_windows(x, y, case=case, method=method)
+                assert np.array_equal(windows, [[0, nchan-1]])
+
+
+def test_quantized():
+    # a quantized spectrum, whose adjacent channels are mostly equal, keeps a noise and finds its line
+    rng = np.random.default_rng(18)
+    nchan = 5000
+    x = np.linspace(2.2E5, 2.21E5, nchan)
+    y = np.round(rng.normal(0., 0.3, nchan))
+    y[2000:2100] += 20.
+    assert core.noise_std(y) > 0
+    for method in ('sigmaclip', 'runmed'):
+        mask = core.windows_to_mask(core.auto_windows(x, y, method=method), nchan)
+        assert not mask[2000:2100].any()
+        assert mask.mean() > 0.8
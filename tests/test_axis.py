@@ -0,0 +1,48 @@
+import numpy as np
+
+import Linemarker_core as core
+
+
+def grids(rng):
+    # uniform, jittered within and beyond a quarter of a step, irregular, with repeated values, and tiny
+    n = int(rng.integers(2, 500))
+    step = rng.uniform(0.01, 2.)
+    x0 = rng.uniform(-1E3, 2.3E5)
+    uniform = x0+step*np.arange(n)
+    yield uniform
+    yield uniform+rng.uniform(-0.1, 0.1, n)*step
+    yield np.sort(uniform+rng.uniform(-0.6, 0.6, n)*step)
+    yield x0+np.cumsum(rng.exponential(step, n))
+    yield np.sort(np.round(uniform/(3*step))*3*step)
+    yield uniform[:1]
+
+
+def test_lookups():
+    rng = np.random.default_rng(19)
+    for trial in range(30):
+        for x in grids(rng):
+            axis = core.SpectralAxis(x, x)
+            # the channels themselves, between them, and beyond both ends
+            span = x[-1]-x[0]+1.
+            values = np.concatenate([x, x[:-1]+np.diff(x)/2, x+1E-9*span, x-1E-9*span,
+                                     rng.uniform(x[0]-span, x[-1]+span, 100)])
+            for value in values:
+                for side in ('left', 'right'):
+                    assert axis.searchsorted(value, side) == int(np.searchsorted(x, value, side=side))
+            for x1, x2 in rng.choice(values, size=(100, 2)):
+                for inclusive in (False, True):
+                    assert axis.channel_range(x1, x2, inclusive) == core.channel_range(x, x1, x2, inclusive)
+
+
+def test_on_grid():
+    rng = np.random.default_rng(20)
+    for trial in range(100):
+        for x in grids(rng):
+            axis = core.SpectralAxis(x, x)
+            # blocks of a few channels, so that the grid is checked across their edges
+            axis.chunksize = int(rng.integers(1, 100))
+            step = (x[-1]-x[0])/max(len(x)-1, 1)
+            offset = np.abs(x-(x[0]+step*np.arange(len(x)))).max()
+            for tol in (1E-6, 0.1, 0.25, 0.5):
+                assert axis.on_grid(tol) == ((step > 0) and (offset <= tol*step))
+            assert axis.uniform == axis.on_grid(0.25)
@@ -0,0 +1,29 @@
+import os
+import shutil
+
+import numpy as np
+
+import Linemarker_core as core
+import Linemarker_export as export
+
+testdata = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+
+
+def test_export_twice(tmp_path):
+    # the outputs of a first export (and the caches of the spectra) are not taken as spectra by the next ones
+    specfile = str(tmp_path / 'spw0.tsv')
+    shutil.copy(os.path.join(testdata, 'spw0spe_test1.tsv'), specfile)
+    shutil.copy(os.path.join(testdata, 'spw0spe_test1_strict_winstr.txt'), str(tmp_path / 'spw0_strict_winstr.txt'))
+    argv = [str(tmp_path), '--winsuffix', '_strict_winstr.txt', '--nproc', '1', '--overwrite']
+    for fmt in ('tsv', 'npy', 'fits'):
+        assert export.main(argv+['--format', fmt]) == 0
+    files = sorted(os.listdir(str(tmp_path)))
+    assert 'spw0_contsub.tsv' in files and 'spw0_contsub.fits' in files and 'spw0_winstats.tsv' in files
+    assert core.find_spectra([str(tmp_path)]) == [specfile]
+    for fmt in ('tsv', 'npy', 'fits'):
+        assert export.main(argv+['--format', fmt]) == 0
+    assert sorted(os.listdir(str(tmp_path))) == files
+    # still the continuum subtracted spectrum of spw0.tsv, one row per channel
+    x, y = core.getdata_from_file(specfile, cache=False)
+    sub = np.loadtxt(str(tmp_path / 'spw0_contsub.tsv'))
+    assert len(sub) == len(x)
@@ -0,0 +1,143 @@
+import numpy as np
+from numpy.polynomial.legendre import legval, legvander
+
+import Linemarker_core as core
+
+
+def make_spectrum(rng, nchan, noise=0.05):
+    # a smooth baseline, noise, and lines both inside and outside of the windows
+    x = np.linspace(2.2E5, 2.21E5, nchan)
+    t = np.linspace(-1., 1., nchan)
+    y = np.sin(3.*t)+0.3*t**5+rng.normal(0., noise, nchan)
+    for c in rng.integers(0, nchan, 40):
+        y[c:c+nchan//500+1] += rng.uniform(0.1, 1.)
+    mask = np.zeros(nchan, dtype='bool')
+    for i0 in rng.integers(0, nchan, 30):
+        mask[i0:i0+int(rng.integers(nchan//100, nchan//10))] = True
+    return x, y, core.parse_mask_edges(mask)
+
+
+def qr_lstsq(A, b):
+    Q, R = np.linalg.qr(A)
+    return np.linalg.solve(R, Q.T@b)
+
+
+def irls_reference(fitter, fitorder, scale_step=1, tol=1E-12):
+    # the dense Tukey IRLS of RobustFit, each step solved by QR on sqrt(w)*V, iterated to convergence
+    channels = core.windows_channels(fitter.windows)
+    V = legvander(fitter.normalise(fitter.x[channels]), fitorder)
+    y = fitter.y[channels]
+    coef = qr_lstsq(V, y)
+    for i in range(100):
+        res = y-V@coef
+        scale = 1.4826*np.median(np.abs(res[::scale_step]))
+        u = res/(fitter.tukey_c*scale)
+        sw = np.clip(1.-u*u, 0., None)
+        new = qr_lstsq(V*sw[:, None], sw*y)
+        if np.abs(new-coef).sum() <= tol*scale:
+            return new
+        coef = new
+    return coef
+
+
+def test_incremental():
+    # the sums updated over a sequence of window edits give the least squares of the current windows
+    rng = np.random.default_rng(8)
+    nchan = 3000
+    x, y, windows = make_spectrum(rng, nchan)
+    for cls in (core.IncrementalFit, core.ChebyshevFit):
+        fitter = cls(x, y, maxorder=3)
+        fitter.refresh_every = 40
+        for step in range(150):
+            if rng.random() < 0.1:
+                windows = core.parse_mask_edges(np.repeat(rng.random(nchan//10) < 0.5, 10))
+            else:
+                # mostly within the extent of the windows, as a drag would do
+                first, last = np.sort(rng.integers(windows[0, 0], windows[-1, 1]+1, size=2))
+                if rng.random() < 0.5:
+                    windows = core.windows_union(windows, first, last)
+                elif core.windows_nchan(core.windows_subtract(windows, first, last)) > 20:
+                    windows = core.windows_subtract(windows, first, last)
+            fitorder = int(rng.integers(0, 9))
+            fitter.set_windows(windows)
+            coef = fitter.solve(fitorder)
+            # compared on the channels of the windows: a few windows far apart leave the fit loose in between
+            channels = core.windows_channels(windows)
+            t = fitter.normalise(x[channels])
+            ref = qr_lstsq(legvander(t, fitorder), y[channels])
+            assert np.abs(fitter.evaluate(coef, x[channels])-legval(t, ref)).max() < 1E-7
+            if fitorder <= 4:
+                # the monomials of fit_baseline lose more digits at the higher orders
+                yfit = core.fit_baseline(x, y, core.windows_to_mask(windows, nchan), fitorder)
+                assert np.abs(fitter.evaluate(coef, x[channels])-yfit[channels]).max() < 1E-8
+        assert fitter.maxorder == 8
+
+
+def test_robust_small():
+    # fewer channels than nscale: all the iterations run on all the channels
+    rng = np.random.default_rng(9)
+    for fitorder in (0, 1, 3, 10, 20):
+        x, y, windows = make_spectrum(rng, 20000)
+        fitter = core.RobustFit(x, y)
+        fitter.set_windows(windows, maxorder=fitorder)
+        fitter.tol = 1E-12
+        fitter.maxiter = 100
+        coef = fitter.solve(fitorder)
+        ref = irls_reference(fitter, fitorder)
+        assert np.abs(fitter.evaluate(coef, x)-fitter.evaluate(ref, x)).max() < 1E-8
+
+
+def test_robust_large():
+    # iterations on a subsample, then one solve on all the channels: close to the dense IRLS, well within the noise
+    rng = np.random.default_rng(10)
+    noise = 0.05
+    x, y, windows = make_spectrum(rng, 600000, noise=noise)
+    for fitorder in (3, 10):
+        fitter = core.RobustFit(x, y)
+        fitter.set_windows(windows, maxorder=fitorder)
+        coef = fitter.solve(fitorder)
+        ref = irls_reference(fitter, fitorder, tol=1E-8)
+        extent = x[windows[0, 0]:windows[-1, 1]+1]
+        assert np.abs(fitter.evaluate(coef, extent)-fitter.evaluate(ref, extent)).max() < 0.02*noise
+
+
+def test_piecewise():
+    rng = np.random.default_rng(11)
+    for nseg, fitorder in ((1, 3), (8, 3), (5, 0), (20, 6)):
+        x, y, windows = make_spectrum(rng, 20000)
+        fitter = core.PiecewiseFit(x, y, nseg=nseg)
+        fitter.set_windows(windows)
+        coef = fitter.solve(fitorder)
+        yfit = fitter.evaluate(coef, x)
+        channels = core.windows_channels(windows)
+        xmin, xmax = x[windows[0, 0]], x[windows[-1, 1]]
+        seg = np.clip(np.floor((x-xmin)/(xmax-xmin)*nseg).astype('int64'), 0, nseg-1)
+        for i in range(nseg):
+            inside = channels[seg[channels] == i]
+            if len(inside) <= fitorder:
+                assert np.isnan(yfit[seg == i]).all()
+                continue
+            # the monomials of the position in the segment, solved by QR
+            t = 2.*((x-xmin)/(xmax-xmin)*nseg-i)-1.
+            ref = qr_lstsq(np.vander(t[inside], fitorder+1), y[inside])
+            assert np.abs(yfit[inside]-np.polyval(ref, t[inside])).max() < 1E-8
+
+
+def test_spline():
+    rng = np.random.default_rng(12)
+    for nseg in (1, 5, 20, 200):
+        x, y, windows = make_spectrum(rng, 20000)
+        fitter = core.SplineFit(x, y, nseg=nseg)
+        fitter.set_windows(windows)
+        coef = fitter.solve()
+        channels = core.windows_channels(windows)
+        n = nseg+3
+        # the dense design matrix, one B-spline per column, which sum to 1 everywhere
+        B = np.array([fitter.evaluate(np.eye(n)[i], x[channels]) for i in range(n)]).T
+        assert np.abs(B.sum(axis=1)-1.).max() < 1E-12
+        assert (B >= -1E-15).all()
+        # the penalised least squares, solved by QR on the stacked system
+        lam = fitter.penalty*(B*B).sum(axis=0).mean()
+        D = np.diff(np.eye(n), 2, axis=0)
+        ref = qr_lstsq(np.vstack([B, np.sqrt(lam)*D]), np.concatenate([y[channels], np.zeros(n-2)]))
+        assert np.abs(fitter.evaluate(coef, x)-fitter.evaluate(ref, x)).max() < 1E-8
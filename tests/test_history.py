@@ -0,0 +1,72 @@
+import numpy as np
+
+import Linemarker_core as core
+
+
+def random_windows(rng, previous, nchan):
+    # mostly small edits of the previous windows, as a drag would do, sometimes all new windows
+    if (previous is None) or (rng.random() < 0.1):
+        mask = rng.random(nchan) < 0.3
+        return core.parse_mask_edges(np.repeat(mask, 8)[:nchan])
+    first, last = np.sort(rng.integers(0, nchan, size=2))
+    if rng.random() < 0.5:
+        return core.windows_union(previous, first, last)
+    return core.windows_subtract(previous, first, last)
+
+
+def check_history(history, expected):
+    assert len(history) == len(expected)
+    assert all(np.array_equal(a, b) for a, b in zip(list(history), expected))
+    # random access, in no particular order
+    for i in np.random.default_rng(len(expected)).permutation(len(expected)):
+        assert np.array_equal(history[i], expected[i])
+        assert np.array_equal(history[i-len(expected)], expected[i])
+
+
+def test_history_budget():
+    rng = np.random.default_rng(5)
+    nchan = 2000
+    for budget in (0, 2000, 20000, 16*2**20):
+        history = core.WindowsHistory(budget=budget)
+        expected = []
+        windows = None
+        for step in range(300):
+            windows = random_windows(rng, windows, nchan)
+            history.append(windows)
+            expected.append(windows)
+            # the oldest entries are dropped first, the last one is always kept
+            expected = expected[len(expected)-len(history):]
+            assert len(history) >= 1
+            assert (history.nbytes <= budget) or (len(history) == 1)
+            assert history.nbytes == sum(a.nbytes+history.entry_overhead for a in history.data.values())
+        check_history(history, expected)
+        if budget == 16*2**20:
+            assert len(history) == 300
+
+
+def test_history_truncate_pop():
+    rng = np.random.default_rng(6)
+    nchan = 500
+    history = core.WindowsHistory()
+    expected = []
+    windows = None
+    for step in range(400):
+        action = rng.random()
+        if (action < 0.15) and (len(expected) > 0):
+            # undo some entries and drop the redo ones, as a new edit after undos does
+            n = int(rng.integers(0, len(expected)+1))
+            history.truncate(n)
+            expected = expected[:n]
+            windows = expected[-1] if expected else None
+        elif (action < 0.25) and (len(expected) > 0):
+            history.pop_first()
+            expected = expected[1:]
+        else:
+            windows = random_windows(rng, windows, nchan)
+            history.append(windows)
+            expected.append(windows)
+        if rng.random() < 0.2:
+            check_history(history, expected)
+    check_history(history, expected)
+    history.clear()
+    check_history(history, [])
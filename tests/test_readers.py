@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import Linemarker_core as core
+import Linemarker_export as export
+
+
+def write(path, text, newline='\n'):
+    with open(str(path), 'wb') as f:
+        f.write(text.replace('\n', newline).encode())
+    return str(path)
+
+
+def spectrum_text(x, y, header='', sep='\t'):
+    return header+''.join('%.17g%s%.17g\n' % (a, sep, b) for a, b in zip(x, y))
+
+
+def random_spectrum(rng, nchan):
+    x = np.sort(rng.uniform(1E2, 3E2, nchan))
+    return x, rng.normal(0., 1., nchan)
+
+
+def test_line_endings(tmp_path):
+    # CRLF line endings and no final newline, with blocks ending anywhere in the lines
+    rng = np.random.default_rng(13)
+    x, y = random_spectrum(rng, 500)
+    text = spectrum_text(x, y, header='#title: test\n# xLabel: Frequency (GHz)\n')
+    for newline in ('\n', '\r\n'):
+        for final in (True, False):
+            filename = write(tmp_path / ('spec%i%i.tsv' % (len(newline), final)), text if final else text[:-1], newline)
+            for chunksize in (7, 64, 1000, 2**22):
+                xr, yr, header = core.read_text(filename, chunksize=chunksize)
+                assert np.array_equal(xr, x) and np.array_equal(yr, y)
+                assert header.splitlines() == ['#title: test', '# xLabel: Frequency (GHz)']
+
+
+def test_columns(tmp_path):
+    # the extra columns are dropped, but the rows must all have the same number of columns
+    rng = np.random.default_rng(14)
+    x, y = random_spectrum(rng, 200)
+    z = np.arange(200.)
+    text = ''.join('%.17g %.17g %.17g\n' % row for row in zip(x, y, z))
+    xr, yr, header = core.read_text(write(tmp_path / 'three.dat', text), chunksize=100)
+    assert np.array_equal(xr, x) and np.array_equal(yr, y)
+    lines = text.splitlines(True)
+    for i in (0, 1, 57, 199):
+        for row in ('%.17g %.17g\n' % (x[i], y[i]), '%.17g %.17g %.17g 0.5\n' % (x[i], y[i], z[i]), '%.17g\n' % x[i]):
+            filename = write(tmp_path / 'bad.dat', ''.join(lines[:i]+[row]+lines[i+1:]))
+            for chunksize in (100, 2**22):
+                with pytest.raises(ValueError):
+                    core.read_text(filename, chunksize=chunksize)
+    with pytest.raises(ValueError):
+        core.read_text(write(tmp_path / 'one.dat', ''.join('%.17g\n' % v for v in x)))
+    with pytest.raises(ValueError):
+        core.read_text(write(tmp_path / 'empty.dat', '# only a header\n'))
+
+
+def test_csv_header(tmp_path):
+    rng = np.random.default_rng(15)
+    x, y = random_spectrum(rng, 300)
+    filename = write(tmp_path / 'spec.csv', spectrum_text(x, y, header='freq_MHz,flux\n', sep=','), '\r\n')
+    xr, yr, header = core.read_csv(filename, chunksize=50)
+    assert np.array_equal(xr, x) and np.array_equal(yr, y)
+    assert header == 'freq_MHz,flux'
+    xr, yr = core.getdata_from_file(filename, cache=False)
+    assert np.array_equal(xr, x) and np.array_equal(yr, y)
+    # a single line of column names
+    with pytest.raises(ValueError):
+        core.read_csv(write(tmp_path / 'names.csv', 'freq,flux\nchannel,value\n'+spectrum_text(x, y, sep=',')))
+
+
+def test_unit_factor(tmp_path):
+    assert core.text_unit_factor('#title: spw0\n# xLabel: [LSRK] Frequency (GHz)') == 1E3
+    assert core.text_unit_factor('freq_MHz,flux') == 1.
+    assert core.text_unit_factor('# frequency (kHz)') == 1E-3
+    assert core.text_unit_factor('# nu [Hz]') == 1E-6
+    # the first unit found, and GHz without a unit
+    assert core.text_unit_factor('# x: MHz, y: Jy/beam, rest frequency 230 GHz') == 1.
+    assert core.text_unit_factor('# Jy/beam, a header about nothing') == 1E3
+    assert core.text_unit_factor('') == 1E3
+    rng = np.random.default_rng(16)
+    x, y = random_spectrum(rng, 100)
+    for header, factor in (('', 1E3), ('# xLabel: Frequency (GHz)\n', 1E3), ('# Frequency (MHz)\n', 1.),
+                           ('# Frequency (kHz)\n', 1E-3), ('# Frequency (Hz)\n', 1E-6)):
+        xr, yr = core.getdata_from_file(write(tmp_path / 'spec.tsv', spectrum_text(x, y, header=header)), cache=False)
+        assert np.array_equal(xr, x*factor) and np.array_equal(yr, y)
+
+
+def test_fits_round_trip(tmp_path):
+    # the FITS written by the export, with the frequencies in the WCS or in the FREQ extension, are read back
+    fits = pytest.importorskip('astropy.io.fits')
+    rng = np.random.default_rng(17)
+    nchan = 1000
+    linear = 2.3E5+0.25*np.arange(nchan)
+    jittered = linear+rng.uniform(-0.05, 0.05, nchan)
+    for name, x in (('linear', linear), ('jittered', jittered)):
+        y = np.sin(np.linspace(0., 3., nchan))+rng.normal(0., 0.1, nchan)
+        contsub = export.Contsub(x, y, np.array([[0, nchan-1]]), chunksize=300)
+        filename = str(tmp_path / (name+'.fits'))
+        export.write_fits(filename, contsub)
+        with fits.open(filename) as hdul:
+            assert ('FREQ' in hdul) == (name == 'jittered')
+        xr, yr = core.getdata_from_file(filename)
+        assert np.abs(xr-x).max() < 1E-6
+        assert np.abs(yr-(y-contsub.fitter.evaluate(contsub.coef, x))).max() < 1E-12
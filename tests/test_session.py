@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import Linemarker_core as core
+
+
+def random_windows(rng, nchan):
+    mask = np.repeat(rng.random(nchan) < 0.3, 5)[:nchan]
+    return core.parse_mask_edges(mask)
+
+
+def random_state(rng, nchan):
+    windows = random_windows(rng, nchan) if rng.random() < 0.8 else None
+    history = [random_windows(rng, nchan) for i in range(int(rng.integers(0, 6)))]
+    return windows, history, int(rng.integers(-1, len(history)))
+
+
+def check_windows(a, b):
+    if a is None or b is None:
+        assert a is None and b is None
+    else:
+        assert np.array_equal(a, b)
+
+
+def test_session_round_trip(tmp_path):
+    rng = np.random.default_rng(7)
+    for trial in range(20):
+        nchan = int(rng.integers(2, 2000))
+        x = np.sort(rng.uniform(2E5, 2.1E5, nchan))
+        y = rng.normal(size=nchan)
+        windows, history, current = random_state(rng, nchan)
+        states = {'spw%i.tsv' % i: random_state(rng, nchan) for i in range(int(rng.integers(0, 4)))}
+        xlim = tuple(np.sort(rng.uniform(2E5, 2.1E5, 2))) if rng.random() < 0.5 else None
+        session_files = ['spw.tsv']+list(states)
+        filename = str(tmp_path / ('s%i' % trial+core.session_appendstr))
+        core.save_session(filename, x, y, specfile='spw.tsv', windows=windows, history=history,
+                          history_current=current, fitorder=3, xlim=xlim, states=states,
+                          session_files=session_files, session_index=0, fitspec='robust3')
+        d = core.load_session(filename)
+        assert isinstance(d['x'], np.memmap) and isinstance(d['y'], np.memmap)
+        assert np.array_equal(d['x'], x) and np.array_equal(d['y'], y)
+        assert d['specfile'] == 'spw.tsv'
+        check_windows(d['windows'], windows)
+        assert len(d['history']) == len(history)
+        for a, b in zip(d['history'], history):
+            assert np.array_equal(a, b)
+        assert d['history_current'] == current
+        assert (d['fitorder'], d['fitspec']) == (3, 'robust3')
+        assert d['xlim'] == xlim
+        assert sorted(d['states']) == sorted(states)
+        for f, (w, h, c) in d['states'].items():
+            check_windows(w, states[f][0])
+            assert len(h) == len(states[f][1])
+            for a, b in zip(h, states[f][1]):
+                assert np.array_equal(a, b)
+            assert c == states[f][2]
+        assert (d['session_files'], d['session_index']) == (session_files, 0)
+
+
+def test_load_npz(tmp_path):
+    rng = np.random.default_rng(8)
+    arrays = dict(a=rng.normal(size=(7, 3)), b=np.arange(10, dtype='int32'),
+                  c=np.asfortranarray(rng.normal(size=(4, 5))), d=np.array('text'), e=np.zeros((0, 2)))
+    for compressed in (False, True):
+        filename = str(tmp_path / ('arrays%i.npz' % compressed))
+        (np.savez_compressed if compressed else np.savez)(filename, **arrays)
+        loaded = core.load_npz(filename, mmap_keys=('a', 'c', 'e'))
+        assert sorted(loaded) == sorted(arrays)
+        for key in arrays:
+            assert loaded[key].dtype == arrays[key].dtype
+            assert np.array_equal(loaded[key], arrays[key])
+        # only the stored members can be memory-mapped
+        assert isinstance(loaded['a'], np.memmap) != compressed
+        assert not isinstance(loaded['b'], np.memmap)
+
+
+def test_load_session_errors(tmp_path):
+    filename = str(tmp_path / 'bad.npz')
+    with open(filename, 'w') as f:
+        f.write('not a session')
+    with pytest.raises(ValueError):
+        core.load_session(filename)
+    np.savez(filename, version=np.array(core.session_version+1))
+    with pytest.raises(ValueError):
+        core.load_session(filename)
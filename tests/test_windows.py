@@ -0,0 +1,76 @@
+import numpy as np
+
+import Linemarker_core as core
+
+
+def random_mask(rng, nchan):
+    # runs of random lengths, so that the windows touch, overlap the edges and are sometimes empty
+    runs = rng.integers(1, 12, size=nchan)
+    values = rng.random(nchan) < rng.uniform(0.1, 0.9)
+    return np.repeat(values, runs)[:nchan]
+
+
+def mask_of(windows, nchan):
+    return core.windows_to_mask(windows, nchan)
+
+
+def check_normalised(windows):
+    assert windows.dtype == np.int64
+    assert windows.shape[1:] == (2,)
+    assert (windows[:, 0] <= windows[:, 1]).all()
+    # sorted, and neither overlapping nor adjacent
+    assert (windows[1:, 0] > windows[:-1, 1]+1).all()
+
+
+def test_mask_round_trip():
+    rng = np.random.default_rng(1)
+    for trial in range(200):
+        nchan = int(rng.integers(1, 300))
+        mask = random_mask(rng, nchan)
+        windows = core.parse_mask_edges(mask)
+        check_normalised(windows)
+        assert np.array_equal(mask_of(windows, nchan), mask)
+        assert np.array_equal(core.windows_channels(windows), np.nonzero(mask)[0])
+        assert core.windows_nchan(windows) == mask.sum()
+
+
+def test_normalise_overlapping():
+    rng = np.random.default_rng(2)
+    for trial in range(200):
+        nchan = int(rng.integers(1, 300))
+        edges = np.sort(rng.integers(0, nchan, size=(int(rng.integers(0, 20)), 2)), axis=1)
+        windows = core.normalise_windows(edges)
+        check_normalised(windows)
+        assert np.array_equal(mask_of(windows, nchan), mask_of(edges, nchan))
+
+
+def test_union_subtract():
+    rng = np.random.default_rng(3)
+    for trial in range(500):
+        nchan = int(rng.integers(1, 300))
+        mask = random_mask(rng, nchan)
+        windows = core.parse_mask_edges(mask)
+        first, last = np.sort(rng.integers(-5, nchan+5, size=2))
+        inside = (np.arange(nchan) >= first) & (np.arange(nchan) <= last)
+        union = core.windows_union(windows, max(first, 0), min(last, nchan-1))
+        check_normalised(union)
+        assert np.array_equal(mask_of(union, nchan), mask | inside)
+        subtracted = core.windows_subtract(windows, first, last)
+        check_normalised(subtracted)
+        assert np.array_equal(mask_of(subtracted, nchan), mask & ~inside)
+
+
+def test_contain_difference_xor():
+    rng = np.random.default_rng(4)
+    for trial in range(500):
+        nchan = int(rng.integers(1, 300))
+        a, b = random_mask(rng, nchan), random_mask(rng, nchan)
+        wa, wb = core.parse_mask_edges(a), core.parse_mask_edges(b)
+        assert np.array_equal(core.windows_contain(wa, np.arange(nchan)), a)
+        difference = core.windows_difference(wa, wb)
+        check_normalised(difference)
+        assert np.array_equal(mask_of(difference, nchan), a & ~b)
+        xor = core.windows_xor(wa, wb)
+        check_normalised(xor)
+        assert np.array_equal(mask_of(xor, nchan), a ^ b)
+        assert np.array_equal(core.windows_xor(wa, xor), wb)
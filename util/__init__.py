@@ -1 +1 @@
-from . import toggleswitch, myscrollbar
+from . import toggleswitch, myscrollbar, pyramid, blitter, instrument, loader, session, overview, watcher
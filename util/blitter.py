@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+
+class Blitter:
+    """
+    Keep the static part of a figure (axes, ticks, labels) as a cached background, and redraw
+    only the registered artists on top of it.
+    The registered artists are set animated, so a full draw of the canvas leaves them out of
+    the background; they are drawn on top right after each full draw (on "draw_event").
+    Usage:
+        blitter = Blitter(canvas)
+        blitter.add_artist(line)
+        ...change line...
+        blitter.blit()          # the axes are unchanged
+        canvas.draw_idle()      # the axes (e.g., limits) changed, the background is rebuilt
+    """
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_artist(self, artist):
+        if artist not in self.artists:
+            artist.set_animated(True)
+            self.artists.append(artist)
+        return artist
+
+    def remove_artist(self, artist):
+        if artist in self.artists:
+            self.artists.remove(artist)
+
+    def on_draw(self, event):
+        # savefig switches to another canvas (e.g., pdf) and draws the animated artists itself
+        if (event.canvas is not self.canvas) or self.canvas.is_saving():
+            return
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        fig = self.canvas.figure
+        for artist in sorted(self.artists, key=lambda a: a.get_zorder()):
+            if artist.axes is not None:
+                fig.draw_artist(artist)
+
+    def blit(self):
+        """
+        Restore the background and draw the artists. Fall back to a (coalesced) full draw
+        if there is no background yet.
+        """
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    @contextmanager
+    def static(self):
+        """
+        Animated artists are skipped by savefig, so make them static while saving.
+        """
+        for artist in self.artists:
+            artist.set_animated(False)
+        try:
+            yield
+        finally:
+            for artist in self.artists:
+                artist.set_animated(True)
@@ -0,0 +1,86 @@
+import time
+import json
+from collections import deque
+from contextlib import contextmanager
+
+class Instrument:
+    """
+    Opt-in timing of the handlers of the GUI.
+    Every call is recorded with its wall time under a name and a kind ('compute' for the handlers,
+    'draw' for the canvas draws and blits), to give per-name call counts, total/max times and a rolling
+    mean over the last calls. The calls are also kept as a trace, which can be dumped in the json format
+    of chrome://tracing (or https://ui.perfetto.dev).
+    When not enabled, timed() does nothing but yield.
+    """
+    def __init__(self, enabled=False, window=50, maxtrace=200000):
+        self.enabled = enabled
+        self.window = window
+        self.stats = {}
+        self.toplevel = {'compute': 0., 'draw': 0.}
+        self.trace = deque(maxlen=maxtrace)
+        self.t0 = time.perf_counter()
+        self.depth = 0
+
+    @contextmanager
+    def timed(self, name, kind='compute'):
+        if not self.enabled:
+            yield
+            return
+        self.depth += 1
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter()-t
+            self.depth -= 1
+            self.record(name, kind, dt, t)
+
+    def wrap(self, func, name, kind='compute'):
+        def wrapper(*arg, **kw):
+            with self.timed(name, kind):
+                return func(*arg, **kw)
+        return wrapper
+
+    def record(self, name, kind, dt, t):
+        s = self.stats.get(name)
+        if s is None:
+            s = self.stats[name] = dict(kind=kind, count=0, total=0., max=0., recent=deque(maxlen=self.window))
+        s['count'] += 1
+        s['total'] += dt
+        s['max'] = max(s['max'], dt)
+        s['recent'].append(dt)
+        if self.depth == 0:
+            self.toplevel[kind] = self.toplevel.get(kind, 0.)+dt
+        self.trace.append((name, kind, t-self.t0, dt, self.depth))
+
+    def rolling_mean(self, name):
+        recent = self.stats[name]['recent']
+        return sum(recent)/len(recent) if recent else 0.
+
+    def total(self, kind):
+        # the handlers nest (e.g., draw_callback calls update_shadow), so only the outermost calls are summed
+        return self.toplevel.get(kind, 0.)
+
+    def status_line(self, nmax=4):
+        """
+        e.g. 'draw 35.2 ms (12) | blit 2.1 ms (40) | update_fitline 1.3 ms (40)'
+        with the rolling mean time and the call count, the slowest first.
+        """
+        names = sorted(self.stats, key=self.rolling_mean, reverse=True)[:nmax]
+        return ' | '.join('%s %.1f ms (%i)' %(name, self.rolling_mean(name)*1E3, self.stats[name]['count']) for name in names)
+
+    def summary(self):
+        lines = ['%-28s %-8s %8s %12s %12s %12s' %('name', 'kind', 'count', 'total (ms)', 'mean (ms)', 'max (ms)')]
+        for name, s in sorted(self.stats.items(), key=lambda i: i[1]['total'], reverse=True):
+            lines.append('%-28s %-8s %8i %12.2f %12.3f %12.3f' %(name, s['kind'], s['count'], s['total']*1E3,
+                                                                 s['total']/s['count']*1E3, s['max']*1E3))
+        lines.append('compute %.2f ms, draw %.2f ms' %(self.total('compute')*1E3, self.total('draw')*1E3))
+        return '\n'.join(lines)
+
+    def dump_json(self, filename):
+        events = [dict(name=name, cat=kind, ph='X', ts=t*1E6, dur=dt*1E6, pid=0, tid=0, args=dict(depth=depth))
+                  for name, kind, t, dt, depth in self.trace]
+        stats = {name: dict(kind=s['kind'], count=s['count'], total=s['total'], max=s['max'])
+                 for name, s in self.stats.items()}
+        with open(filename, 'w') as f:
+            json.dump(dict(traceEvents=events, stats=stats), f)
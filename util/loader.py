@@ -0,0 +1,85 @@
+import threading
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, callback, errback, onprogress):
+        self.callback = callback
+        self.errback = errback
+        self.onprogress = onprogress
+        self.cancelled = threading.Event()
+        self.fraction = 0.
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def progress(self, fraction):
+        # called from the worker: raising here is how a cancelled job stops at its next checkpoint
+        if self.cancelled.is_set():
+            raise Cancelled()
+        self.fraction = fraction
+
+
+class BackgroundLoader:
+    """
+    Run a loading function in a worker thread, and hand its result back on the Tk main loop.
+    The worker never touches Tk: the main loop polls the job with master.after, shows its progress
+    with onprogress(fraction), and then calls callback(result) or errback(exception).
+    One job runs at a time, a new submit cancels the running one.
+    A job is cancelled at the next call of its progress function (passed to func as progress=...);
+    a func without checkpoints runs to its end, but its result is dropped.
+    Usage:
+        loader = BackgroundLoader(master)
+        loader.submit(core.getdata_from_file, (filename,), callback=show, onprogress=bar.set)
+        loader.cancel()
+    """
+    def __init__(self, master, poll=50):
+        self.master = master
+        self.poll = poll
+        self.job = None
+
+    @property
+    def busy(self):
+        return self.job is not None
+
+    def submit(self, func, args=(), callback=None, errback=None, onprogress=None):
+        self.cancel()
+        job = Job(callback, errback, onprogress)
+        self.job = job
+        thread = threading.Thread(target=self._run, args=(job, func, args), daemon=True)
+        thread.start()
+        self.master.after(self.poll, self._check, job)
+        return job
+
+    def _run(self, job, func, args):
+        try:
+            job.result = func(*args, progress=job.progress)
+        except BaseException as e:
+            job.error = e
+        job.done = True
+
+    def _check(self, job):
+        if job.cancelled.is_set():
+            return
+        if job.onprogress is not None:
+            job.onprogress(job.fraction)
+        if not job.done:
+            self.master.after(self.poll, self._check, job)
+            return
+        self.job = None
+        if job.error is not None:
+            if isinstance(job.error, Cancelled):
+                return
+            if job.errback is None:
+                raise job.error
+            job.errback(job.error)
+        elif job.callback is not None:
+            job.callback(job.result)
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancelled.set()
+            self.job = None
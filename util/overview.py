@@ -0,0 +1,83 @@
+from matplotlib.patches import Rectangle
+from matplotlib.collections import PolyCollection
+from .blitter import Blitter
+
+class Overview:
+    """
+    A strip showing the whole spectrum, decimated to the width of the strip, with the windows shaded,
+    and the x range of the main axes as a rectangle (the viewport).
+    The spectrum and the windows are static, and drawn only when they change; the viewport is blitted.
+    A click jumps the viewport to the clicked frequency, and the viewport can be dragged.
+    command(x1,x2) is called with the new x range whenever the viewport is moved with the mouse.
+    Usage:
+        overview = Overview(fig, command=set_xlim)
+        overview.set_data(x, y)
+        overview.set_spans(verts)     # see Linemarker_core.window_spans
+        overview.set_view(x1, x2)
+    """
+    def __init__(self, fig, command=None, rect=[0.05, 0.05, 0.9, 0.9], alpha=0.4, color='gray'):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.command = command
+        self.ax = fig.add_axes(rect)
+        self.ax.set_xticks([])
+        self.ax.set_yticks([])
+        self.line = self.ax.plot([], [], color='C0', lw=0.6)[0]
+        self.spans = PolyCollection([], transform=self.ax.get_xaxis_transform(),
+                                    facecolor=color, edgecolor='none', alpha=alpha)
+        self.ax.add_collection(self.spans, autolim=False)
+        self.viewport = Rectangle((0, 0), 0, 1, transform=self.ax.get_xaxis_transform(),
+                                  facecolor='C1', edgecolor='C1', alpha=0.3)
+        self.ax.add_patch(self.viewport)
+        self.blitter = Blitter(self.canvas)
+        self.blitter.add_artist(self.viewport)
+        self.drag = None
+        self.canvas.mpl_connect('button_press_event', self.on_press)
+        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('button_release_event', self.on_release)
+
+    def get_npix(self):
+        return self.ax.get_window_extent().width
+
+    def set_data(self, x, y):
+        self.line.set_data(x, y)
+        self.ax.set_xlim(x.min(), x.max())
+        dy = (y.max()-y.min())*0.05
+        self.ax.set_ylim(y.min()-dy, y.max()+dy)
+        self.canvas.draw_idle()
+
+    def set_spans(self, verts):
+        self.spans.set_verts(verts)
+        self.canvas.draw_idle()
+
+    def set_view(self, x1, x2):
+        self.viewport.set_x(x1)
+        self.viewport.set_width(x2-x1)
+        self.blitter.blit()
+
+    def on_press(self, event):
+        if (event.inaxes is not self.ax) or (event.button != 1):
+            return
+        if len(self.line.get_xdata()) == 0:
+            # no spectrum yet
+            return
+        x1 = self.viewport.get_x()
+        width = self.viewport.get_width()
+        if not (x1 <= event.xdata <= x1+width):
+            # jump: center the viewport on the click, then drag it from there
+            x1 = event.xdata-width/2.
+            self.move(x1, width)
+        self.drag = event.xdata-x1
+
+    def on_motion(self, event):
+        if (self.drag is None) or (event.inaxes is not self.ax):
+            return
+        self.move(event.xdata-self.drag, self.viewport.get_width())
+
+    def on_release(self, event):
+        self.drag = None
+
+    def move(self, x1, width):
+        self.set_view(x1, x1+width)
+        if self.command is not None:
+            self.command(x1, x1+width)
@@ -0,0 +1,45 @@
+import numpy as np
+
+class MinMaxPyramid:
+    """
+    Multi-resolution min/max decimation of a spectrum for plotting.
+    Level k keeps, for every block of 2**k channels, the indices of the minimum and the maximum.
+    A query over an x range picks the level giving about one block per screen pixel, so the
+    number of points to draw depends on the width of the axes rather than the number of channels,
+    while every peak and dip of the spectrum is still drawn.
+    class members:
+        x, y: the spectrum, x in ascending order
+        levels: list of (imin, imax) for block sizes 2, 4, 8, ...
+    """
+    def __init__(self, x, y, minblocks=256):
+        self.x = x
+        self.y = y
+        self.levels = []
+        imin = imax = np.arange(len(y))
+        while len(imin) > minblocks:
+            imin = self._reduce(imin, np.less_equal)
+            imax = self._reduce(imax, np.greater_equal)
+            self.levels.append((imin, imax))
+
+    def _reduce(self, dex, compare):
+        if len(dex) % 2:
+            dex = np.append(dex, dex[-1])
+        a, b = dex[0::2], dex[1::2]
+        return np.where(compare(self.y[a], self.y[b]), a, b)
+
+    def query(self, x1, x2, npix):
+        """
+        Return the (x, y) to be drawn for the range x1~x2 over npix pixels.
+        One channel outside the range is kept on each side, so the line reaches the edges of the axes.
+        """
+        i0 = max(np.searchsorted(self.x, x1, side='left')-1, 0)
+        i1 = min(np.searchsorted(self.x, x2, side='right')+1, len(self.x))
+        npix = max(int(npix), 1)
+        k = int(np.floor(np.log2(max((i1-i0)/(2.*npix), 1.))))
+        k = min(k, len(self.levels))
+        if k == 0:
+            return self.x[i0:i1], self.y[i0:i1]
+        imin, imax = self.levels[k-1]
+        b0, b1 = i0 >> k, ((i1-1) >> k)+1
+        dex = np.sort(np.stack([imin[b0:b1], imax[b0:b1]], axis=1), axis=1).ravel()
+        return self.x[dex], self.y[dex]
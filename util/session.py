@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SpectrumSession:
+    """
+    An ordered list of spectrum files reviewed one after another.
+    get(index) returns a Future of reader(filename) and prefetches the nprefetch following spectra
+    in a worker thread, so that stepping to the next spectrum usually finds it already read.
+    Only the futures around the current spectrum (the previous one and the prefetched ones) are kept.
+    states holds whatever the GUI keeps per spectrum (e.g., the windows and their history), by file name.
+    index is the spectrum shown, and target the one asked for last, which differs while it is being read,
+    so that the steps are counted from the target.
+    """
+    def __init__(self, filenames, reader, nprefetch=2):
+        self.filenames = list(filenames)
+        self.reader = reader
+        self.nprefetch = nprefetch
+        self.index = -1
+        self.target = -1
+        self.futures = {}
+        self.states = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    @property
+    def current(self):
+        if 0 <= self.index < len(self.filenames):
+            return self.filenames[self.index]
+        return None
+
+    def _submit(self, index):
+        filename = self.filenames[index]
+        if filename not in self.futures:
+            self.futures[filename] = self.executor.submit(self.reader, filename)
+        return self.futures[filename]
+
+    def get(self, index):
+        future = self._submit(index)
+        keep = range(max(index-1, 0), min(index+self.nprefetch+1, len(self.filenames)))
+        for i in keep:
+            if i > index:
+                self._submit(i)
+        keepnames = set(self.filenames[i] for i in keep)
+        for filename in list(self.futures):
+            if filename not in keepnames:
+                self.futures.pop(filename).cancel()
+        return future
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.executor.shutdown(wait=False)
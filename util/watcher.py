@@ -0,0 +1,62 @@
+import os
+
+
+class FileWatcher:
+    """
+    Poll files with os.stat on the Tk main loop, and call callback(filename) when the size or the mtime
+    of a file change (also when a missing file appears).
+    A change is reported only once the file is the same for two polls in a row, so that a file being
+    rewritten by another program is read once it is whole, and several writes between two polls are
+    reported once. Nothing is read from the files here, a poll costs one stat per file.
+    If the callback returns False, the change is reported again at the next poll (e.g., when busy).
+    Usage:
+        watcher = FileWatcher(master, interval=1000)
+        watcher.watch(filename, callback)
+        watcher.clear()
+    """
+    def __init__(self, master, interval=1000):
+        self.master = master
+        self.interval = interval
+        self.files = {}
+        self.job = None
+
+    @staticmethod
+    def signature(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def watch(self, filename, callback):
+        # the file as it is now is known, only its next changes are reported
+        self.files[filename] = dict(signature=self.signature(filename), pending=None, callback=callback)
+        if self.job is None:
+            self.job = self.master.after(self.interval, self.poll)
+
+    def unwatch(self, filename):
+        self.files.pop(filename, None)
+
+    def clear(self):
+        self.files = {}
+        if self.job is not None:
+            self.master.after_cancel(self.job)
+            self.job = None
+
+    def poll(self):
+        self.job = None
+        for filename, entry in list(self.files.items()):
+            if self.files.get(filename) is not entry:
+                # dropped or watched anew by a callback
+                continue
+            signature = self.signature(filename)
+            if (signature == entry['signature']) or (signature is None):
+                entry['pending'] = None
+            elif signature != entry['pending']:
+                # changed since the last poll, wait until it settles
+                entry['pending'] = signature
+            elif entry['callback'](filename) is not False:
+                entry['signature'] = signature
+                entry['pending'] = None
+        if self.files and (self.job is None):
+            self.job = self.master.after(self.interval, self.poll)